@@ -1,8 +1,12 @@
 # Importation des modules Dash et autres modules nécessaires
-from dash import Dash, dcc, html, Input, Output, callback
+from dash import Dash, dcc, html, Input, Output, State, Patch, ALL, MATCH, callback, ctx, no_update
 import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+
+import functools, json, os, threading
+from collections import OrderedDict
 
 # Définition des feuilles de style externes à utiliser pour le tableau de bord
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
@@ -10,36 +14,199 @@ external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 # Initialisation de l'application Dash
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 
+# Nombre de lignes des données (variable d'environnement CROSSFILTER_ROWS, par exemple 1000000 pour tester les performances)
+N_ROWS = int(os.environ.get("CROSSFILTER_ROWS", 30))
+
 # Génération d'un DataFrame de données aléatoires avec 6 colonnes
 np.random.seed(0)  # Seed pour la reproductibilité des données
-df = pd.DataFrame({"Col " + str(i + 1): np.random.rand(30) for i in range(6)})
+df = pd.DataFrame({"Col " + str(i + 1): np.random.rand(N_ROWS) for i in range(6)})
 
-# Définition de la mise en page du tableau de bord
-app.layout = html.Div(
-    [
-        # Trois graphiques disposés en lignes et chacun dans une colonne de largeur quatre
-        html.Div(
-            dcc.Graph(id="g1", config={"displayModeBar": False}),
-            className="four columns",
-        ),
-        html.Div(
-            dcc.Graph(id="g2", config={"displayModeBar": False}),
-            className="four columns",
-        ),
-        html.Div(
-            dcc.Graph(id="g3", config={"displayModeBar": False}),
-            className="four columns",
-        ),
-    ],
-    className="row",
-)
 
-# Définition d'une fonction pour obtenir la figure du graphique en fonction des données sélectionnées
-def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
+# Colonnes (x, y) de chaque vue : une vue de plus ne demande qu'une paire de colonnes de plus
+VIEWS = [("Col 1", "Col 2"), ("Col 3", "Col 4"), ("Col 5", "Col 6")]
+
+# Au-delà de ce nombre de points (variable d'environnement CROSSFILTER_DENSITY_POINTS), chaque vue affiche une grille
+# de densité de DENSITY_BINS x DENSITY_BINS cases calculée sur le serveur au lieu d'un marqueur par point
+DENSITY_MIN_POINTS = int(os.environ.get("CROSSFILTER_DENSITY_POINTS", 5000))
+DENSITY_BINS = 128
+density_mode = len(df) > DENSITY_MIN_POINTS
+
+
+# Fonction pour tester quels points (x, y) sont dans un polygone (règle pair-impair), triés par y croissant
+# Chaque côté ne traite que les points de sa bande horizontale (recherche dichotomique dans y trié)
+def points_in_polygon(x, y, poly_x, poly_y):
+    inside = np.zeros(len(x), dtype=bool)
+    for i in range(len(poly_x)):
+        x0, y0, x1, y1 = poly_x[i - 1], poly_y[i - 1], poly_x[i], poly_y[i]
+        if y0 == y1:
+            continue  # Côté horizontal : jamais traversé par la demi-droite horizontale d'un point
+        start, stop = np.searchsorted(y, [min(y0, y1), max(y0, y1)])
+        band_x, band_y = x[start:stop], y[start:stop]
+        inside[start:stop] ^= band_x < x0 + (band_y - y0) * (x1 - x0) / (y1 - y0)
+    return inside
+
+
+# Moteur de filtrage croisé : un masque booléen par vue, combinés par un ET vectorisé
+# La sélection de chaque vue est résolue sur le serveur à partir de sa seule forme : le rectangle (`range`)
+# ou le lasso (`lassoPoints`), le navigateur n'envoyant plus la liste des points sélectionnés. Un index trié
+# par colonne donne en deux recherches dichotomiques les lignes comprises dans un intervalle.
+# Le masque d'une vue ne dépend que de sa propre sélection : il est gardé en cache sous (vue, forme de la
+# sélection), si bien que seule la vue dont la sélection a changé est recalculée. Le cache ne dépend que des
+# entrées du callback : plusieurs utilisateurs peuvent filtrer en même temps sans se gêner.
+class CrossfilterEngine:
+    def __init__(self, df, views, max_cached=32):
+        self.df = df
+        self.views = views
+        self.n_rows = len(df)
+        self.max_cached = max_cached
+        self._sorted = {}  # Colonne -> (ordre des lignes, valeurs triées), construit à la première sélection
+        self._masks = OrderedDict()  # (vue, forme sérialisée) -> masque booléen
+        self._lock = threading.Lock()
+
+    # Index trié d'une colonne
+    def sorted_index(self, col):
+        index = self._sorted.get(col)
+        if index is None:
+            values = self.df[col].to_numpy()
+            order = np.argsort(values, kind="stable")
+            index = self._sorted[col] = (order, values[order])
+        return index
+
+    # Lignes dont la valeur de `col` est dans [low, high], dans l'ordre croissant de cette valeur
+    def range_rows(self, col, low, high):
+        order, values = self.sorted_index(col)
+        low, high = min(low, high), max(low, high)
+        start = np.searchsorted(values, low, side="left")
+        stop = np.searchsorted(values, high, side="right")
+        return order[start:stop]
+
+    # Lignes comprises dans le rectangle x_range x y_range : la colonne la plus sélective donne les candidates
+    def box_rows(self, x_col, y_col, x_range, y_range):
+        rows_x = self.range_rows(x_col, *x_range)
+        rows_y = self.range_rows(y_col, *y_range)
+        rows, other_col, (low, high) = (rows_x, y_col, sorted(y_range)) if len(rows_x) <= len(rows_y) else (rows_y, x_col, sorted(x_range))
+        other = self.df[other_col].to_numpy()[rows]
+        return rows[(other >= low) & (other <= high)]
+
+    # Lignes comprises dans un lasso : rectangle englobant, puis test point dans polygone sur les candidates
+    def lasso_rows(self, x_col, y_col, poly_x, poly_y):
+        poly_x, poly_y = np.asarray(poly_x, dtype=float), np.asarray(poly_y, dtype=float)
+        rows = self.range_rows(y_col, poly_y.min(), poly_y.max())  # Triées par y croissant
+        x = self.df[x_col].to_numpy()[rows]
+        in_box = (x >= poly_x.min()) & (x <= poly_x.max())
+        rows, x = rows[in_box], x[in_box]
+        y = self.df[y_col].to_numpy()[rows]
+        return rows[points_in_polygon(x, y, poly_x, poly_y)]
 
-    # Gestion de la sélection des points dans le graphique
-    if selectedpoints_local and selectedpoints_local["range"]:
-        ranges = selectedpoints_local["range"]
+    # Masque des lignes sélectionnées dans une vue (None si la vue ne filtre rien)
+    def mask(self, view, selection):
+        if not selection:
+            return None
+        key = (view, json.dumps(selection, sort_keys=True))
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        x_col, y_col = self.views[view]
+        if selection.get("range"):
+            rows = self.box_rows(x_col, y_col, selection["range"]["x"], selection["range"]["y"])
+        elif selection.get("lassoPoints"):
+            rows = self.lasso_rows(x_col, y_col, selection["lassoPoints"]["x"], selection["lassoPoints"]["y"])
+        else:
+            return None
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_cached:
+                self._masks.popitem(last=False)
+        return mask
+
+    # Lignes retenues par tous les filtres : chaque vue, y compris celle qui porte la sélection, met en évidence
+    # la même intersection (la sélection propre à une vue reste visible par son rectangle pointillé)
+    def combine(self, masks):
+        active = [mask for mask in masks if mask is not None]
+        if not active:
+            return np.ones(self.n_rows, dtype=bool)
+        return np.logical_and.reduce(active)
+
+
+crossfilter = CrossfilterEngine(df, VIEWS)
+
+# Fonction pour combiner les sélections des vues : masque des lignes retenues, ou None si aucune vue ne filtre
+def selected_rows(selections):
+    masks = [crossfilter.mask(view, selection) for view, selection in enumerate(selections)]
+    if all(mask is None for mask in masks):
+        return None
+    return crossfilter.combine(masks)
+
+# Fonction pour calculer l'étendue complète des valeurs d'une vue : [[x min, x max], [y min, y max]]
+def full_ranges(x_col, y_col):
+    return [[float(df[x_col].min()), float(df[x_col].max())], [float(df[y_col].min()), float(df[y_col].max())]]
+
+# Fonction pour calculer la case de la grille de chaque ligne pour une étendue donnée (DENSITY_BINS ** 2 hors de l'étendue)
+# et le nombre total de lignes de chaque case
+# Gardés en cache : une sélection ne fait ensuite qu'un np.bincount sur les cases des lignes retenues
+@functools.lru_cache(maxsize=16)
+def grid_cells(x_col, y_col, x_range, y_range):
+    cells = np.full(len(df), DENSITY_BINS * DENSITY_BINS, dtype=np.intp)
+    x, y = df[x_col].to_numpy(), df[y_col].to_numpy()
+    (x0, x1), (y0, y1) = sorted(x_range), sorted(y_range)
+    inside = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+    ix = np.minimum(((x[inside] - x0) * (DENSITY_BINS / ((x1 - x0) or 1))).astype(np.intp), DENSITY_BINS - 1)
+    iy = np.minimum(((y[inside] - y0) * (DENSITY_BINS / ((y1 - y0) or 1))).astype(np.intp), DENSITY_BINS - 1)
+    cells[inside] = iy * DENSITY_BINS + ix
+    n_cells = DENSITY_BINS * DENSITY_BINS
+    total = np.bincount(cells, minlength=n_cells + 1)[:n_cells]
+    cells.flags.writeable = False  # Tableaux partagés par les callbacks à travers le cache
+    total.flags.writeable = False
+    return cells, total
+
+# Fonction pour compter les points non sélectionnés et sélectionnés de chaque case (échelle logarithmique, cases vides transparentes)
+# `selected` : lignes retenues (indices ou masque booléen), None si aucune vue ne filtre
+def density_grids(x_col, y_col, ranges, selected):
+    cells, total = grid_cells(x_col, y_col, tuple(ranges[0]), tuple(ranges[1]))
+    n_cells = DENSITY_BINS * DENSITY_BINS
+    chosen = total if selected is None else np.bincount(cells[selected], minlength=n_cells + 1)[:n_cells]
+    grids = []
+    for counts in (total - chosen, chosen):
+        grid = np.round(np.log1p(counts.reshape(DENSITY_BINS, DENSITY_BINS).astype(float)), 1)
+        grid[counts.reshape(DENSITY_BINS, DENSITY_BINS) == 0] = np.nan
+        grids.append(grid)
+    return grids
+
+# Fonction pour calculer la position des grilles (centre de la première case et pas) pour une étendue donnée
+def grid_position(ranges):
+    (x0, x1), (y0, y1) = sorted(ranges[0]), sorted(ranges[1])
+    dx, dy = (x1 - x0) / DENSITY_BINS, (y1 - y0) / DENSITY_BINS
+    return {"x0": x0 + dx / 2, "dx": dx, "y0": y0 + dy / 2, "dy": dy}
+
+# Fonction pour mettre à jour par Patch les deux grilles d'une figure de densité
+def patch_density(patched_fig, x_col, y_col, ranges, selected):
+    position = grid_position(ranges)
+    for trace, grid in enumerate(density_grids(x_col, y_col, ranges, selected)):
+        patched_fig["data"][trace]["z"] = grid
+        for name, value in position.items():
+            patched_fig["data"][trace][name] = value
+    return patched_fig
+
+# Fonction pour déduire l'étendue affichée d'une vue après un zoom, un déplacement ou un double-clic (relayoutData)
+def zoomed_ranges(relayout_data, ranges, x_col, y_col):
+    new_ranges = [list(ranges[0]), list(ranges[1])]
+    for k, (axis, full) in enumerate(zip(("xaxis", "yaxis"), full_ranges(x_col, y_col))):
+        if relayout_data.get(axis + ".autorange"):
+            new_ranges[k] = full
+        elif axis + ".range[0]" in relayout_data:
+            new_ranges[k] = [relayout_data[axis + ".range[0]"], relayout_data[axis + ".range[1]"]]
+        elif axis + ".range" in relayout_data:
+            new_ranges[k] = list(relayout_data[axis + ".range"])
+    return new_ranges
+
+# Fonction pour calculer le rectangle pointillé qui montre la sélection d'une vue (toute l'étendue sans sélection)
+def selection_shape(df, x_col, y_col, selection):
+    if selection and selection.get("range"):
+        ranges = selection["range"]
         selection_bounds = {
             "x0": ranges["x"][0],
             "x1": ranges["x"][1],
@@ -53,6 +220,26 @@ def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
             "y0": np.min(df[y_col]),
             "y1": np.max(df[y_col]),
         }
+    return dict({"type": "rect", "line": {"width": 1, "dash": "dot", "color": "darkgrey"}}, **selection_bounds)
+
+# Fonction pour appliquer la mise en page commune aux vues et ajouter le rectangle de sélection
+def style_figure(fig, df, x_col, y_col, selection):
+    # Mise à jour du layout du graphique
+    fig.update_layout(
+        margin={"l": 20, "r": 0, "b": 15, "t": 5},
+        dragmode="select",
+        hovermode=False,
+        newselection_mode="gradual",
+        uirevision="crossfilter",  # Le zoom de l'utilisateur est conservé quand la figure est mise à jour par Patch
+    )
+
+    # Ajout d'une zone de sélection sur le graphique
+    fig.add_shape(selection_shape(df, x_col, y_col, selection))
+    return fig
+
+# Définition d'une fonction pour obtenir la figure du graphique en fonction des données sélectionnées
+# (appelée une seule fois par vue au démarrage : les sélections ne modifient ensuite la figure que par Patch)
+def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
 
     # Création du graphique avec Plotly Express
     fig = px.scatter(df, x=df[x_col], y=df[y_col], text=df.index)
@@ -60,7 +247,6 @@ def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
     # Mise à jour du style des points sélectionnés et non sélectionnés
     fig.update_traces(
         selectedpoints=selectedpoints,
-        customdata=df.index,
         mode="markers+text",
         marker={"color": "rgba(0, 116, 217, 0.7)", "size": 20},
         unselected={
@@ -69,46 +255,127 @@ def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
         },
     )
 
-    # Mise à jour du layout du graphique
-    fig.update_layout(
-        margin={"l": 20, "r": 0, "b": 15, "t": 5},
-        dragmode="select",
-        hovermode=False,
-        newselection_mode="gradual",
+    return style_figure(fig, df, x_col, y_col, selectedpoints_local)
+
+# Fonction pour obtenir la figure de densité d'une vue : grilles des points non sélectionnés (gris) et sélectionnés (bleu)
+# superposées, la taille de la figure ne dépend que de DENSITY_BINS et non du nombre de points
+def get_density_figure(df, x_col, y_col, selected, selection, ranges):
+    fig = go.Figure()
+    position = grid_position(ranges)
+    colorscales = (
+        [[0, "rgba(128, 128, 128, 0.15)"], [1, "rgba(128, 128, 128, 0.6)"]],
+        [[0, "rgba(0, 116, 217, 0.25)"], [1, "rgba(0, 116, 217, 1)"]],
     )
+    for grid, colorscale in zip(density_grids(x_col, y_col, ranges, selected), colorscales):
+        fig.add_trace(go.Heatmap(z=grid, colorscale=colorscale, showscale=False, hoverinfo="skip", **position))
+    # Deux points invisibles aux coins des données : les heatmaps ne sont pas sélectionnables, cette trace permet
+    # au navigateur de produire la forme de la sélection (rectangle ou lasso)
+    (x_min, x_max), (y_min, y_max) = full_ranges(x_col, y_col)
+    fig.add_trace(go.Scatter(x=[x_min, x_max], y=[y_min, y_max], mode="markers", marker={"opacity": 0}, hoverinfo="skip"))
+    fig.update_layout(showlegend=False, xaxis_title=x_col, yaxis_title=y_col)
+    return style_figure(fig, df, x_col, y_col, selection)
 
-    # Ajout d'une zone de sélection sur le graphique
-    fig.add_shape(
-        dict(
-            {"type": "rect", "line": {"width": 1, "dash": "dot", "color": "darkgrey"}},
-            **selection_bounds
-        )
+# Fonction pour obtenir la figure initiale d'une vue, selon le mode d'affichage
+def initial_figure(view):
+    if density_mode:
+        return get_density_figure(df, *VIEWS[view], None, None, full_ranges(*VIEWS[view]))
+    return get_figure(df, *VIEWS[view], None, None)
+
+# Fonction pour créer les vues liées : un graphique par paire de colonnes, avec des identifiants à motif
+# ({"type": ..., "index": position de la vue}) que les callbacks désignent toutes à la fois (ALL) ou une à une (MATCH)
+def crossfilter_views(views):
+    children = []
+    for view, (x_col, y_col) in enumerate(views):
+        children += [
+            # Forme de la sélection du graphique (rectangle ou lasso), seule information envoyée au serveur
+            dcc.Store(id={"type": "crossfilter-selection", "index": view}),
+            # Étendue affichée du graphique, sur laquelle sont calculées les grilles du mode densité
+            dcc.Store(id={"type": "crossfilter-range", "index": view}, data=full_ranges(x_col, y_col)),
+            # Graphiques disposés en lignes, chacun dans une colonne de largeur quatre
+            html.Div(
+                dcc.Graph(id={"type": "crossfilter-graph", "index": view}, figure=initial_figure(view), config={"displayModeBar": False}),
+                className="four columns",
+            ),
+        ]
+    return children
+
+# Définition de la mise en page du tableau de bord
+app.layout = html.Div(crossfilter_views(VIEWS), className="row")
+
+# Fonction JavaScript (exécutée dans le navigateur) pour ne garder de selectedData que la forme de la sélection :
+# la requête envoyée au serveur a la même taille quel que soit le nombre de points sélectionnés
+selection_geometry = """
+function(selectedData) {
+    if (!selectedData) {
+        return null;
+    }
+    if (selectedData.range) {
+        return {range: selectedData.range};
+    }
+    if (selectedData.lassoPoints) {
+        return {lassoPoints: selectedData.lassoPoints};
+    }
+    return null;
+}
+"""
+app.clientside_callback(
+    selection_geometry,
+    Output({"type": "crossfilter-selection", "index": MATCH}, "data"),
+    Input({"type": "crossfilter-graph", "index": MATCH}, "selectedData"),
+)
+
+# Fonction callback pour recalculer les grilles d'une vue sur la zone zoomée (mode densité)
+# Un seul callback pour toutes les vues : MATCH ne transmet que le graphique zoomé et son étendue
+if density_mode:
+    @callback(
+        Output({"type": "crossfilter-graph", "index": MATCH}, "figure", allow_duplicate=True),
+        Output({"type": "crossfilter-range", "index": MATCH}, "data"),
+        Input({"type": "crossfilter-graph", "index": MATCH}, "relayoutData"),
+        State({"type": "crossfilter-range", "index": MATCH}, "data"),
+        State({"type": "crossfilter-selection", "index": ALL}, "data"),
+        prevent_initial_call=True,
     )
-    return fig
+    def rebin(relayout_data, ranges, selections):
+        view = ctx.triggered_id["index"]
+        new_ranges = zoomed_ranges(relayout_data or {}, ranges, *VIEWS[view])
+        if new_ranges == ranges:
+            return no_update, no_update  # Sélection ou autre changement sans effet sur l'étendue affichée
+        selected = selected_rows(selections)
+        rows = np.flatnonzero(selected) if selected is not None else None
+        return patch_density(Patch(), *VIEWS[view], new_ranges, rows), new_ranges
 
 # Définition de la fonction de callback pour mettre à jour les graphiques en fonction des sélections
+# Les entrées et sorties désignent toutes les vues par motif (ALL) : la signature ne dépend pas du nombre de vues
 @callback(
-    Output("g1", "figure"),
-    Output("g2", "figure"),
-    Output("g3", "figure"),
-    Input("g1", "selectedData"),
-    Input("g2", "selectedData"),
-    Input("g3", "selectedData"),
+    Output({"type": "crossfilter-graph", "index": ALL}, "figure"),
+    Input({"type": "crossfilter-selection", "index": ALL}, "data"),
+    State({"type": "crossfilter-range", "index": ALL}, "data"),
+    prevent_initial_call=True,  # Les figures complètes sont construites une fois pour toutes au démarrage
 )
-def callback(selection1, selection2, selection3):
-    selectedpoints = df.index
-    for selected_data in [selection1, selection2, selection3]:
-        if selected_data and selected_data["points"]:
-            selectedpoints = np.intersect1d(
-                selectedpoints, [p["customdata"] for p in selected_data["points"]]
-            )
-
-    # Renvoi des figures mises à jour
-    return [
-        get_figure(df, "Col 1", "Col 2", selectedpoints, selection1),
-        get_figure(df, "Col 3", "Col 4", selectedpoints, selection2),
-        get_figure(df, "Col 5", "Col 6", selectedpoints, selection3),
-    ]
+def callback(selections, ranges):
+    # Vue dont la sélection vient de changer : seul son masque est recalculé (les autres viennent du cache)
+    # et seul son rectangle de sélection est redessiné
+    changed_view = ctx.triggered_id["index"] if ctx.triggered_id else None
+
+    # Un masque par vue, résolu à partir de la forme de la sélection, puis combinés par un ET
+    selected = selected_rows(selections)
+    # Lignes retenues, calculées une seule fois pour toutes les vues ; sans aucun filtre, tous les points sont
+    # affichés normalement : inutile d'envoyer la liste de toutes les lignes
+    rows = np.flatnonzero(selected) if selected is not None else None
+
+    # Mises à jour partielles : seuls les points sélectionnés (ou les grilles du mode densité) de chaque figure
+    # changent, ainsi que le rectangle de sélection de la vue qui vient d'être modifiée
+    patches = []
+    for view, (selection, view_ranges) in enumerate(zip(selections, ranges)):
+        patched_fig = Patch()
+        if density_mode:
+            patch_density(patched_fig, *VIEWS[view], view_ranges, rows)
+        else:
+            patched_fig["data"][0]["selectedpoints"] = rows
+        if view == changed_view:
+            patched_fig["layout"]["shapes"][0] = selection_shape(df, *VIEWS[view], selection)
+        patches.append(patched_fig)
+    return patches
 
 # Démarrage de l'application en mode débogage si ce script est exécuté en tant que programme principal
 if __name__ == "__main__":
@@ -3,8 +3,10 @@ import plotly.express as px
 from dash import Dash, dcc, html
 from skimage import data
 
-# Chargement d'une image à partir du module scikit-image
-img = data.chelsea()
+from shared_store import shared_store
+
+# Chargement de l'image de test (une image de chat), écrite une seule fois sur disque et partagée entre les workers
+img = shared_store.get_or_create("skimage-chelsea", data.chelsea)
 
 # Création d'une figure Plotly Express à partir de l'image chargée
 fig = px.imshow(img)
@@ -1,14 +1,17 @@
 # Import des modules nécessaires
-import plotly.express as px
 from dash import Dash, dcc, html, Input, Output, callback
 import dash_daq as daq
 from skimage import data
 
-# Chargement de l'image de test (une image de chat)
-img = data.chelsea()
+from shared_store import shared_store
+from image_encoder import image_figure, register_image_route
 
-# Création de la figure Plotly avec l'image et configuration du style des annotations
-fig = px.imshow(img)
+# Chargement de l'image de test (une image de chat), écrite une seule fois sur disque et partagée entre les workers
+img_key = "skimage-chelsea"
+img = shared_store.get_or_create(img_key, data.chelsea)
+
+# Création de la figure Plotly avec l'image (référencée par URL) et configuration du style des annotations
+fig = image_figure(img_key, img.shape)
 fig.update_layout(
     dragmode="drawrect",  # Mode de dessin : rectangle
     newshape=dict(
@@ -24,6 +27,9 @@ fig.update_layout(
 # Initialisation de l'application Dash
 app = Dash(__name__)
 
+# Route Flask servant l'image encodée : elle est encodée une seule fois et gardée en cache par le navigateur
+register_image_route(app.server, load_image=shared_store.get)
+
 # Définition de la mise en page de l'application
 app.layout = html.Div(
     [
@@ -52,7 +58,8 @@ app.layout = html.Div(
 )
 def on_style_change(slider_value, color_value):
     # Création d'une nouvelle figure avec l'image et mise à jour du style des annotations
-    fig = px.imshow(img)
+    # (seule l'URL de l'image est renvoyée : ni réencodage, ni octets de l'image à retransmettre)
+    fig = image_figure(img_key, img.shape)
     fig.update_layout(
         dragmode="drawrect",                        # Mode de dessin : rectangle
         newshape=dict(
@@ -4,8 +4,10 @@ from dash import Dash, dcc, html, Input, Output, no_update, callback
 from skimage import data
 import json
 
-# Chargement de l'image de test (une image de chat)
-img = data.chelsea()
+from shared_store import shared_store
+
+# Chargement de l'image de test (une image de chat), écrite une seule fois sur disque et partagée entre les workers
+img = shared_store.get_or_create("skimage-chelsea", data.chelsea)
 
 # Création de la figure Plotly avec l'image
 fig = px.imshow(img)
@@ -3,15 +3,22 @@ import plotly.express as px
 from dash import Dash, dcc, html, Input, Output, no_update, callback
 from skimage import data
 
-# Chargement de l'image de test (une image de caméra)
-img = data.camera()
+from histogram_index import index_cache
+from histogram_figures import create_histogram
+from shared_store import shared_store
+
+# Chargement de l'image de test (une image de caméra), écrite une seule fois sur disque et partagée entre les workers
+img = shared_store.get_or_create("skimage-camera", data.camera)
 
 # Création de la figure Plotly avec l'image en utilisant le mode de chaîne binaire
 fig = px.imshow(img, binary_string=True)
 fig.update_layout(dragmode="drawrect")  # Activation du mode de dessin de rectangle
 
+# Index d'histogrammes cumulés de l'image (construit une seule fois, puis partagé entre les workers)
+hist_index = index_cache.get("skimage-camera", img)
+
 # Création de l'histogramme de l'image
-fig_hist = px.histogram(img.ravel())
+fig_hist = create_histogram(hist_index.histogram(0, 0, img.shape[1], img.shape[0]))
 
 # Initialisation de l'application Dash
 app = Dash(__name__)
@@ -40,11 +47,9 @@ app.layout = html.Div(
 def on_new_annotation(relayout_data):
     if "shapes" in relayout_data:   # Vérifie si des formes ont été ajoutées à la figure
         last_shape = relayout_data["shapes"][-1]   # Récupère la dernière forme ajoutée (le dernier rectangle dessiné)
-        # Les coordonnées de la forme sont des flottants, nous devons les convertir en entiers pour découper l'image
-        x0, y0 = int(last_shape["x0"]), int(last_shape["y0"])   # Coordonnées du coin supérieur gauche
-        x1, y1 = int(last_shape["x1"]), int(last_shape["y1"])   # Coordonnées du coin inférieur droit
-        roi_img = img[y0:y1, x0:x1]   # Sélectionne la zone d'intérêt (ROI) de l'image
-        return px.histogram(roi_img.ravel())   # Crée un nouvel histogramme pour la zone d'intérêt
+        # Les coordonnées de la forme sont des flottants : l'index les convertit en entiers et les ordonne
+        roi_counts = hist_index.histogram(last_shape["x0"], last_shape["y0"], last_shape["x1"], last_shape["y1"])
+        return create_histogram(roi_counts)   # Crée un nouvel histogramme pour la zone d'intérêt (256 comptes calculés côté serveur)
     else:
         return no_update   # Aucune mise à jour nécessaire si aucune nouvelle annotation n'est présente
 
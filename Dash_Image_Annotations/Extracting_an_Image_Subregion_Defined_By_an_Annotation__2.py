@@ -2,34 +2,21 @@
 import numpy as np
 import plotly.express as px
 from dash import Dash, html, dcc, Input, Output, no_update, callback
-from skimage import data, draw
-from scipy import ndimage
+from skimage import data
 
-# Fonction pour convertir le chemin SVG en tableau numpy de coordonnées, chaque ligne étant un point (ligne, colonne)
-def path_to_indices(path):
-    indices_str = [
-        el.replace("M", "").replace("Z", "").split(",") for el in path.split("L")
-    ]
-    return np.rint(np.array(indices_str, dtype=float)).astype(int)
-
-# Fonction pour convertir le chemin SVG en un masque binaire où tous les pixels enfermés par le chemin sont True, et les autres pixels sont False.
-def path_to_mask(path, shape):
-    cols, rows = path_to_indices(path).T
-    rr, cc = draw.polygon(rows, cols)
-    mask = np.zeros(shape, dtype=bool)
-    mask[rr, cc] = True
-    mask = ndimage.binary_fill_holes(mask)
-    return mask
+from shared_store import shared_store
+from histogram_figures import create_histogram, channel_histogram
+from roi_masks import masked_values
 
-# Chargement de l'image de test (une image de caméra)
-img = data.camera()
+# Chargement de l'image de test (une image de caméra), écrite une seule fois sur disque et partagée entre les workers
+img = shared_store.get_or_create("skimage-camera", data.camera)
 
 # Création de la figure Plotly avec l'image en utilisant le mode de chaîne binaire
 fig = px.imshow(img, binary_string=True)
 fig.update_layout(dragmode="drawclosedpath")  # Activation du mode de dessin de chemin fermé
 
 # Création de l'histogramme de l'image
-fig_hist = px.histogram(img.ravel())
+fig_hist = create_histogram(channel_histogram(img))
 
 # Initialisation de l'application Dash
 app = Dash(__name__)
@@ -58,8 +45,8 @@ app.layout = html.Div(
 def on_new_annotation(relayout_data):
     if "shapes" in relayout_data:   # Vérifie si des formes ont été ajoutées à la figure
         last_shape = relayout_data["shapes"][-1]   # Récupère la dernière forme ajoutée (le dernier chemin dessiné)
-        mask = path_to_mask(last_shape["path"], img.shape)   # Convertit le chemin en masque binaire
-        return px.histogram(img[mask])   # Crée un nouvel histogramme pour la zone d'intérêt
+        roi_values = masked_values(img, last_shape["path"])   # Pixels enfermés par le chemin, lus dans sa seule fenêtre englobante
+        return create_histogram(np.bincount(roi_values, minlength=256))   # Crée un nouvel histogramme pour la zone d'intérêt (comptes calculés côté serveur)
     else:
         return no_update   # Aucune mise à jour nécessaire si aucune nouvelle annotation n'est présente
 
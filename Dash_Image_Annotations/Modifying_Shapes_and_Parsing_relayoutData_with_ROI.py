@@ -2,11 +2,16 @@
 import plotly.express as px
 import plotly.graph_objects as go
 from dash import Dash, dcc, html, Input, Output, no_update, callback
-from skimage import data, exposure
+from skimage import data
 import json
 
-# Chargement de l'image de test (une image de caméra)
-img = data.camera()
+from histogram_index import index_cache
+from histogram_figures import create_histogram
+from shared_store import shared_store
+from relayout_parser import parse_relayout, is_viewport_only, ShapeAdded, ShapeChanged, ShapesReplaced
+
+# Chargement de l'image de test (une image de caméra), écrite une seule fois sur disque et partagée entre les workers
+img = shared_store.get_or_create("skimage-camera", data.camera)
 
 # Création de la figure Plotly avec l'image en utilisant le mode de chaîne binaire
 fig = px.imshow(img, binary_string=True)
@@ -14,8 +19,11 @@ fig = px.imshow(img, binary_string=True)
 # Mise à jour de la disposition de la figure pour activer le mode de dessin de rectangle
 fig.update_layout(dragmode="drawrect")
 
+# Index d'histogrammes cumulés de l'image (construit une seule fois, puis partagé entre les workers)
+hist_index = index_cache.get("skimage-camera", img)
+
 # Création de l'histogramme de l'image
-fig_hist = px.histogram(img.ravel())
+fig_hist = create_histogram(hist_index.histogram(0, 0, img.shape[1], img.shape[0]))
 
 # Configuration des boutons de la barre de mode
 config = {
@@ -54,22 +62,23 @@ app.layout = html.Div(
 )
 def on_relayout(relayout_data):
     x0, y0, x1, y1 = (None,) * 4
-    if "shapes" in relayout_data:   # Vérifie si des formes ont été ajoutées à la figure
-        last_shape = relayout_data["shapes"][-1]   # Récupère la dernière forme ajoutée (le dernier rectangle dessiné)
-        x0, y0 = int(last_shape["x0"]), int(last_shape["y0"])   # Coordonnées du coin supérieur gauche
-        x1, y1 = int(last_shape["x1"]), int(last_shape["y1"])   # Coordonnées du coin inférieur droit
-        if x0 > x1:   # Assure que x0 est inférieur à x1
-            x0, x1 = x1, x0
-        if y0 > y1:   # Assure que y0 est inférieur à y1
-            y0, y1 = y1, y0
-    elif any(["shapes" in key for key in relayout_data]):   # Si plusieurs formes ont été ajoutées à la figure
-        x0 = int([relayout_data[key] for key in relayout_data if "x0" in key][0])   # Coordonnée x0 du dernier rectangle
-        x1 = int([relayout_data[key] for key in relayout_data if "x1" in key][0])   # Coordonnée x1 du dernier rectangle
-        y0 = int([relayout_data[key] for key in relayout_data if "y0" in key][0])   # Coordonnée y0 du dernier rectangle
-        y1 = int([relayout_data[key] for key in relayout_data if "y1" in key][0])   # Coordonnée y1 du dernier rectangle
-    if all((x0, y0, x1, y1)):   # Vérifie si toutes les coordonnées sont non nulles
-        roi_img = img[y0:y1, x0:x1]   # Sélectionne la zone d'intérêt (ROI) de l'image
-        return (px.histogram(roi_img.ravel()), json.dumps(relayout_data, indent=2))   # Renvoie l'histogramme et les données d'annotation
+    events = parse_relayout(relayout_data)   # Traduction de relayoutData en événements (une seule lecture des clés)
+    if is_viewport_only(events):   # Zoom ou déplacement : pas de nouvel histogramme
+        return (no_update,) * 2
+    for event in events:
+        if isinstance(event, ShapesReplaced):   # Liste complète des formes : la dernière est le ROI
+            shape = event.shapes[-1] if event.shapes else {}
+        elif isinstance(event, ShapeAdded):   # Forme ajoutée à la figure
+            shape = event.shape
+        elif isinstance(event, ShapeChanged):   # Forme déplacée ou redimensionnée
+            shape = event.changes
+        else:
+            continue
+        if all(key in shape for key in ("x0", "y0", "x1", "y1")):
+            x0, y0, x1, y1 = shape["x0"], shape["y0"], shape["x1"], shape["y1"]
+    if x0 is not None:   # Vérifie qu'un rectangle a été trouvé
+        roi_counts = hist_index.histogram(x0, y0, x1, y1)   # Histogramme de la zone d'intérêt (ROI) lu dans l'index (coordonnées ordonnées et bornées)
+        return (create_histogram(roi_counts), json.dumps(relayout_data, indent=2))   # Renvoie l'histogramme et les données d'annotation
     else:
         return (no_update,) * 2   # Aucune mise à jour nécessaire si aucune nouvelle annotation n'est présente
 
@@ -1,206 +1,527 @@
 # Importation des modules nécessaires
-from dash import Dash, dcc, html, Input, Output, no_update, callback
+from dash import Dash, dcc, html, dash_table, Input, Output, State, Patch, no_update, callback, ctx
 
 import plotly.express as px
-import plotly.graph_objects as go
 import numpy as np
 from skimage import data
 from PIL import Image
 
-import json, re, base64, io
-
-# Chargement d'une image à partir du module scikit-image
-img_default = data.chelsea()
-
-# Création d'une figure Plotly Express à partir de l'image chargée
-fig = px.imshow(img_default)
-
-# Conversion de l'image en tableau NumPy
-img_array = np.array(img_default)
-
-def create_histogram(img_array):
-    # Séparer les canaux de couleur
-    red_channel = img_array[:, :, 0]
-    green_channel = img_array[:, :, 1]
-    blue_channel = img_array[:, :, 2]
-
-    fig_hist = go.Figure()
-    fig_hist.add_trace(go.Histogram(
-        x=red_channel.ravel(),
-        name='Red', # name used in legend and hover labels
-        marker_color='#FF0000' # Red color
-    ))
-    fig_hist.add_trace(go.Histogram(
-        x=green_channel.ravel(),
-        name='Green',
-        marker_color='#00FF00' # Green color
-    ))
-    fig_hist.add_trace(go.Histogram(
-        x=blue_channel.ravel(),
-        name='Blue',
-        marker_color='#0000FF' # Blue color
-    ))
-
-    # Mise en forme de la figure
-    fig_hist.update_layout(
-        title='Number of pixels as a function of channel intensity value',
-        xaxis_title='8bit pixel values',
-        yaxis_title='count in ROI'
-    )
-
-    return fig_hist
-
-# Création de l'histogramme de l'image
-fig_hist = create_histogram(img_array)
-
-# Mise à jour de la configuration de la figure pour permettre le dessin de rectangles
-fig.update_layout(dragmode="drawrect", title='Matrix image with annotations')
+import json, os, uuid
+
+from image_registry import registry, file_key, make_key
+from shared_store import shared_store
+from histogram_index import ValueScale, counts_stats, index_cache, remap_counts
+from histogram_figures import create_histogram
+from adjustment_pipeline import adjuster_cache, clip, render_adjusted, render_window_level, window_key, window_level
+from annotation_store import AnnotationStore
+from relayout_parser import parse_relayout, is_viewport_only, ShapeAdded, ShapeChanged, ShapeErased, ShapesReplaced, ViewportChanged, Autorange
+from tile_pyramid import pyramid_cache, pyramid_figure, tile_images, register_tile_route
+from image_encoder import image_figure, register_image_route
+from chunked_upload import UploadSpool, register_upload_route
+from shape_statistics import ShapeStatistics, shape_local_mask, stats_cache
+from latest_executor import executor
+from image_dataset import ImageDataset
+from mask_export import coco_document
+
+# Au-delà de ce nombre de pixels, l'image est affichée par tuiles d'une pyramide multi-résolution
+PYRAMID_MIN_PIXELS = 4096 * 4096
+
+# Nombre maximal de pixels d'une image décodée (téléversement ou dossier), modifiable par la variable d'environnement
+# ANNOTATION_MAX_PIXELS. Pillow refuse par défaut les images de plus de ~179 mégapixels (protection contre les
+# « bombes de décompression ») : l'outil est prévu pour un usage local, sur des images de confiance, et la limite est
+# relevée à un gigapixel pour que les très grandes images atteignent la pyramide de tuiles.
+Image.MAX_IMAGE_PIXELS = int(os.environ.get("ANNOTATION_MAX_PIXELS", 1024 ** 3))
+
+# Plus grand côté (en pixels) de l'aperçu affiché pendant le glissement du curseur, de l'ordre de la taille du graphique à l'écran
+PREVIEW_MAX_SIDE = 800
+
+# Fonction pour calculer les réglages du curseur d'après les valeurs de l'image : min, max, pas et graduations
+# (0-255 pour une image uint8, étendue des valeurs pour une image uint16 ou float32)
+def slider_settings(scale):
+    ticks = np.linspace(scale.lo, scale.hi, 9)
+    if scale.integer:
+        return int(scale.lo), int(scale.hi), 1, {int(v): str(int(v)) for v in ticks}
+    return scale.lo, scale.hi, (scale.hi - scale.lo) / 1000 or 1, {float(v): f"{v:.3g}" for v in ticks}
+
+# Fonction pour calculer la clé de la version affichée d'une image source avec la fenêtre [low, high] du curseur
+# uint8 : écrêtage du canal rouge (aucun réglage sur toute l'étendue) ; grande dynamique : fenêtre/niveau ramené en uint8
+def display_key(source_key, img, low, high):
+    if img.dtype != np.uint8:
+        return window_key(source_key, low, high)
+    return make_key(source_key, stages=(clip(0, low, high),)) if [low, high] != [0, 255] else source_key
+
+# Fonction pour calculer le titre de l'axe des valeurs de l'histogramme selon le type de l'image
+def histogram_axis_title(img):
+    return '8bit pixel values' if img.dtype == np.uint8 else f'{img.dtype} pixel values'
+
+# Fonction pour décoder un fichier téléversé (dans un thread de décodage), ou le reprendre du registre s'il a déjà été décodé
+def decode_spooled(path):
+    source_key = file_key(path)
+    # Décoder le fichier en tant qu'objet image uniquement si l'image n'est pas déjà connue
+    registry.get_or_create(source_key, lambda: np.array(Image.open(path)))
+    return source_key
+
+# Fonction pour savoir si une image décodée est encore disponible (registre en mémoire ou stockage partagé)
+def image_exists(key):
+    return key in registry or os.path.exists(shared_store.path(key))
 
 # Configuration des boutons d'annotations à ajouter à la barre d'outils
 config = {
     "modeBarButtonsToAdd": [
-        # "drawcircle",        # Cercle
+        "drawcircle",        # Cercle
         "drawrect",          # Rectangle
+        "drawclosedpath",    # Chemin fermé (lasso)
         "eraseshape",        # Effacer la forme
     ]
 }
 
-# Initialisation de l'application Dash
-app = Dash(__name__)
-
-# Définition de la mise en page du tableau de bord
-app.layout = html.Div(
-    [
-        dcc.Store(id='image-store', data=img_default.tolist()),  # Stockage de l'image téléchargée
-        html.H1(children="Draw annotations", style={"textAlign": "center"}),  # Titre du tableau de bord
-        dcc.Upload(
-            id='upload-image',
-            children=html.Div(['Drag and Drop or Select a picture']),
-            style={
-                'width': '15%',
-                'height': '30px',
-                'lineHeight': '30px',
-                'borderWidsth': '1px',
-                'borderRadius': '15px',
-                'borderStyle': 'dashed',
-                'textAlign': 'center',
-                'backgroundColor': 'grey',
-                "margin": "auto", 
-                "display": "block",
-            },
-        ),
-        html.Div(
-            [dcc.Graph(id='graph', figure=fig, config=config),],  # Graphique interactif avec la figure et la configuration     
-            style={"width": "60%", "display": "inline-block", "padding": "0 0"},
-        ),
-        html.Div(
-            [dcc.Graph(id="histogram", figure=fig_hist),],
-            style={"width": "40%", "display": "inline-block", "padding": "0 0"},
-        ),
-        html.H4(children="Écrêtage du rouge de l'image (min et max)", style={"margin-bottom": "10px"}), 
-        dcc.RangeSlider(id="red-slider", min=0, max=255, value=[0, 255], allowCross=False, marks={i: str(i) for i in [0, 31, 63, 95, 127, 159, 191, 223, 255]}, tooltip={"placement": "bottom", "always_visible": True}), # Curseur pour ajuster la valeur max de la couleur rouge
-        html.Hr(),  # Ligne horizontale pour séparer le graphique des données JSON
-        html.Div(children="JSON Output:", style={"margin-bottom": "20px", "margin-top": "20px"}),  # Titre pour les données JSON des annotations
-        html.Div(       # Div pour afficher les données JSON des annotations
-            id='output-json',
-            style={"border": "1px solid black", "padding": "10px", "width": "95%", "height": "200px", "overflowY": "scroll", "margin": "auto", "display": "block"}  # Ajout de bordures et de marges pour le conteneur du texte
+# Les processus de calcul (latest_executor.py) réimportent ce script sous le nom __mp_main__ : seul le processus du
+# serveur charge le jeu de données, prépare l'image par défaut, ouvre la base d'annotations et crée l'application
+SERVER_PROCESS = __name__ != "__mp_main__"
+
+if SERVER_PROCESS:
+    # Mode jeu de données : dossier d'images à annoter l'une après l'autre (variable d'environnement ANNOTATION_DATASET)
+    DATASET_DIR = os.environ.get("ANNOTATION_DATASET")
+    dataset = ImageDataset(DATASET_DIR) if DATASET_DIR else None
+    if dataset is not None and len(dataset) == 0:
+        raise ValueError(f"Aucune image trouvée dans le dossier {DATASET_DIR!r}")
+
+    if dataset is not None:
+        # Première image du dossier, les suivantes sont préparées en arrière-plan
+        default_key, img_default = dataset.load(0)
+        dataset.prefetch(0)
+    else:
+        # Chargement d'une image à partir du module scikit-image
+        # Le registre l'écrit une seule fois sur disque : les autres workers l'ouvrent en mémoire mappée sans la recharger
+        default_key = "skimage-chelsea"
+        img_default = registry.get_or_create(default_key, data.chelsea)
+
+    # Tableau NumPy de l'image (sans copie : seule la clé de l'image transite par le navigateur)
+    img_array = img_default
+
+    # Index d'histogrammes de l'image par défaut et réglages initiaux du curseur
+    default_index = index_cache.get(default_key, img_array)
+    slider_min, slider_max, slider_step, slider_marks = slider_settings(default_index.scale)
+    default_display_key = display_key(default_key, img_array, slider_min, slider_max)
+    if default_display_key != default_key:
+        registry.get_or_create(default_display_key, lambda: window_level(img_array, slider_min, slider_max, default_index.scale))
+
+    # Création d'une figure qui référence l'image par URL (encodée une seule fois, puis gardée en cache par le serveur et le navigateur)
+    fig = image_figure(default_display_key, img_default.shape)
+
+    # Création de l'histogramme de l'image à partir de son index (construit une seule fois par version d'image)
+    default_values, default_counts = default_index.display_histogram(default_index.histogram(0, 0, img_array.shape[1], img_array.shape[0]))
+    fig_hist = create_histogram(default_counts, xaxis_title=histogram_axis_title(img_array), x=default_values)
+
+    # Mise à jour de la configuration de la figure pour permettre le dessin de rectangles
+    fig.update_layout(dragmode="drawrect", title='Matrix image with annotations')
+
+    # Stockage des annotations par session et par image (SQLite en mode WAL)
+    store = AnnotationStore('annotations.db')
+
+    # Initialisation de l'application Dash
+    app = Dash(__name__)
+
+    # Route Flask servant les tuiles des grandes images (les pyramides évincées sont reconstruites depuis le registre)
+    register_tile_route(app.server, load_image=shared_store.get)
+    # Route Flask servant les images encodées des figures
+    register_image_route(app.server, load_image=shared_store.get)
+    # Routes Flask du téléversement par morceaux (le fichier est écrit sur disque puis décodé hors de la requête)
+    register_upload_route(app.server, UploadSpool(decode_spooled, exists=image_exists))
+else:
+    dataset = None
+
+# Fonction pour afficher la position dans le jeu de données
+def frame_label(index):
+    return f"{index + 1} / {len(dataset)} — {os.path.basename(dataset.files[index])}"
+
+# Fonction pour créer la zone de choix de l'image : téléversement, ou navigation dans le dossier en mode jeu de données
+def image_selector():
+    if dataset is not None:
+        return html.Div(
+            [
+                dcc.Store(id='frame-index', data=0),  # Position de l'image affichée dans le dossier
+                html.Button("Previous", id='previous-image'),
+                html.Span(frame_label(0), id='frame-label', style={"margin": "0 20px"}),
+                html.Button("Next", id='next-image'),
+            ],
+            style={"textAlign": "center"},
         )
-    ]
-)
+    return html.Div(  # Zone de téléversement par morceaux (voir assets/chunked_upload.js)
+        [
+            html.Div(
+                id='upload-image',
+                children=html.Div(['Drag and Drop or Select a picture']),
+                style={
+                    'width': '15%',
+                    'height': '30px',
+                    'lineHeight': '30px',
+                    'borderWidsth': '1px',
+                    'borderRadius': '15px',
+                    'borderStyle': 'dashed',
+                    'textAlign': 'center',
+                    'backgroundColor': 'grey',
+                    "margin": "auto", 
+                    "display": "block",
+                    "cursor": "pointer",
+                },
+            ),
+            html.Div(id='upload-progress', style={"textAlign": "center"}),  # Progression du téléversement
+        ]
+    )
+
+# Définition de la mise en page du tableau de bord (fonction : chaque chargement de page reçoit son identifiant)
+# L'identifiant de page sépare les calculs de chaque onglet (requêtes dépassées, moteur de statistiques) ; la session
+# d'annotation est l'espace de noms du stockage : en mode jeu de données c'est celle du dossier, partagée par tous
+# les onglets, et les annotations de chaque image sont retrouvées d'une visite à l'autre
+def serve_layout():
+    page_id = str(uuid.uuid4())
+    return html.Div(
+        [
+            dcc.Store(id='page-id', data=page_id),  # Identifiant de cette page (calculs et statistiques)
+            dcc.Store(id='session-id', data=dataset.session_id if dataset is not None else page_id),  # Identifiant de la session d'annotation
+            dcc.Store(id='image-store', data=default_display_key),  # Clé de l'image affichée dans le registre côté serveur
+            dcc.Store(id='image-id', data=default_key),  # Clé de l'image source, à laquelle sont rattachées les annotations
+            dcc.Store(id='upload-id'),  # Clé de l'image choisie : téléversée (assets/chunked_upload.js) ou image du dossier
+            html.H1(children="Draw annotations", style={"textAlign": "center"}),  # Titre du tableau de bord
+            image_selector(),
+            html.Div(
+                [dcc.Graph(id='graph', figure=fig, config=config),],  # Graphique interactif avec la figure et la configuration     
+                style={"width": "60%", "display": "inline-block", "padding": "0 0"},
+            ),
+            html.Div(
+                [dcc.Graph(id="histogram", figure=fig_hist),],
+                style={"width": "40%", "display": "inline-block", "padding": "0 0"},
+            ),
+            dash_table.DataTable(  # Statistiques de toutes les formes annotées, une ligne par forme
+                id='shape-stats',
+                columns=[{"name": "Shape", "id": "shape"}, {"name": "Type", "id": "type"}, {"name": "Pixels", "id": "pixels"}]
+                + [{"name": f"Mean {c}", "id": f"mean_{i}"} for i, c in enumerate("RGB")]
+                + [{"name": f"Std {c}", "id": f"std_{i}"} for i, c in enumerate("RGB")]
+                + [{"name": "Duplicate of", "id": "duplicate_of"}],  # Forme presque identique dessinée avant celle-ci
+                data=[],
+                style_table={"width": "95%", "margin": "auto"},
+            ),
+            html.H4(children="Écrêtage du rouge de l'image (min et max) — fenêtre d'affichage pour les images 16 bits et flottantes", style={"margin-bottom": "10px"}), 
+            dcc.RangeSlider(id="red-slider", min=slider_min, max=slider_max, step=slider_step, value=[slider_min, slider_max], allowCross=False, marks=slider_marks, tooltip={"placement": "bottom", "always_visible": True}), # Curseur pour ajuster la valeur max de la couleur rouge
+            html.Hr(),  # Ligne horizontale pour séparer le graphique des données JSON
+            html.Div(children="JSON Output:", style={"margin-bottom": "20px", "margin-top": "20px"}),  # Titre pour les données JSON des annotations
+            html.Div(       # Div pour afficher les données JSON des annotations
+                id='output-json',
+                style={"border": "1px solid black", "padding": "10px", "width": "95%", "height": "200px", "overflowY": "scroll", "margin": "auto", "display": "block"}  # Ajout de bordures et de marges pour le conteneur du texte
+            ),
+            html.Button("Export annotations", id='export-button', style={"margin": "20px auto", "display": "block"}),  # Export des annotations de l'image
+            dcc.Download(id='export-download'),
+            html.Button("Export COCO masks", id='export-coco-button', style={"margin": "20px auto", "display": "block"}),  # Export des masques (RLE COCO)
+            dcc.Download(id='export-coco-download'),
+        ]
+    )
+
+if SERVER_PROCESS:
+    app.layout = serve_layout
 
 
 # Fonction callback pour mettre à jour l'image affichée en fonction de l'image téléchargée
 @callback(
     Output('graph', 'figure'),
     Output('image-store', 'data'), 
-    Input('red-slider', 'value'),  # Déclenchement de la fonction à chaque fois que le curseur est déplacé
-    Input('upload-image', 'contents') # Déclenchement de la fonction à chaque fois qu'une image est téléchargée
+    Output('image-id', 'data'),
+    Output('red-slider', 'min'),  # Bornes, pas et graduations du curseur, adaptés aux valeurs de chaque nouvelle image
+    Output('red-slider', 'max'),
+    Output('red-slider', 'step'),
+    Output('red-slider', 'marks'),
+    Output('red-slider', 'value'),
+    Input('red-slider', 'value'),  # Déclenchement de la fonction au relâchement du curseur (pleine résolution)
+    Input('red-slider', 'drag_value'),  # Déclenchement de la fonction pendant le glissement du curseur (aperçu)
+    Input('upload-id', 'data'), # Déclenchement de la fonction à chaque fois qu'une image est téléversée et décodée
+    State('session-id', 'data'),
+    State('page-id', 'data'),
 )
-def update_output(slider_value, contents):
-    _img_array = img_array
-    if contents is not None:
-        # Convertir les données de l'image en base64
-        img_data = contents.split(",")[1]
-        # Décoder les données base64 en tant qu'objet image
-        decoded_img = base64.b64decode(img_data)
-        img_obj = Image.open(io.BytesIO(decoded_img))
-        _img_array = np.array(img_obj)
-
-        # Supprimer les annotations précédentes
-        with open('annotations.json', 'w') as f:  # Ouvre un fichier JSON en écriture
-            json.dump('', f)  # Écrit les annotations dans le fichier JSON
-
-    # Séparer les canaux de couleur
-    img_red = _img_array[:, :, 0]
-    img_green = _img_array[:, :, 1]
-    img_blue = _img_array[:, :, 2]
+def update_output(slider_value, drag_value, upload_key, session_id, page_id):
+    if upload_key is not None:
+        source_key, _img_array = upload_key, registry.get(upload_key)
+        if _img_array is None:
+            return (no_update,) * 8  # Image supprimée du stockage partagé : il faut la téléverser à nouveau
+
+        # Supprimer les annotations précédentes de cette image lors d'un nouveau téléversement (pas en mode jeu de données)
+        if ctx.triggered_id == 'upload-id' and dataset is None:
+            store.clear(session_id, source_key)
+    else:
+        source_key = default_key
+        _img_array = registry.get_or_create(default_key, lambda: img_array)
 
     print(slider_value)
-    img_red_clipped = np.clip(img_red, slider_value[0], slider_value[1]) # Écrête les valeurs de la couleur rouge
-
-    img_clipped = np.stack([img_red_clipped, img_green, img_blue], axis=-1) # Empile les canaux de couleur pour former une image
+    # Échelle des valeurs de l'image source (bornes du curseur, LUT fenêtre/niveau des images à grande dynamique)
+    scale = ValueScale(_img_array)
+    if drag_value and ctx.triggered_prop_ids.keys() == {'red-slider.drag_value'}:
+        # Aperçu pendant le glissement : image sous-échantillonnée à la taille du graphique, réglée avec les LUT de l'image entière
+        stride = max(1, -(-max(_img_array.shape[:2]) // PREVIEW_MAX_SIDE))
+        if _img_array.dtype == np.uint8:
+            stages = (clip(0, drag_value[0], drag_value[1]),)
+            preview = adjuster_cache.get(source_key, _img_array).apply(stages, _img_array[::stride, ::stride])
+        else:
+            preview = window_level(_img_array[::stride, ::stride], drag_value[0], drag_value[1], scale)
+        # Image encodée en PNG et étirée aux coordonnées de l'image entière : les annotations restent à leur place
+        preview_fig = px.imshow(preview, binary_string=True)
+        preview_fig.update_traces(x0=(stride - 1) / 2, y0=(stride - 1) / 2, dx=stride, dy=stride)
+        preview_fig.update_layout(dragmode="drawrect", shapes=store.snapshot(session_id, source_key))
+        return (preview_fig,) + (no_update,) * 7  # La version pleine résolution reste la référence des autres callbacks
+
+    # Nouvelle image (ou chargement de la page) : le curseur couvre l'étendue de ses valeurs
+    slider_update = (no_update,) * 5
+    if ctx.triggered_id != 'red-slider':
+        low, high, step, marks = slider_settings(scale)
+        slider_value = [low, high]
+        slider_update = (low, high, step, marks, slider_value)
+
+    # Clé de la version affichée : même image et mêmes réglages donnent la même clé
+    # Sans écrêtage, l'image source uint8 (déjà décodée et encodée, par exemple par le préchargement) est affichée telle quelle
+    clipped_key = display_key(source_key, _img_array, *slider_value)
+    img_clipped = registry.get(clipped_key)
+    if img_clipped is None:
+        # Calcul dans le pool de processus ; abandonné (sans mise à jour) si un déplacement plus récent du curseur l'a dépassé
+        if _img_array.dtype == np.uint8:
+            # Écrêtage du canal rouge, fusionné en une LUT par canal et appliqué en une seule passe
+            executor.run(page_id, 'adjust', render_adjusted, source_key, (clip(0, *slider_value),), clipped_key)
+        else:
+            # Fenêtre/niveau : une LUT d'une entrée par classe de valeur ramène l'image en uint8
+            executor.run(page_id, 'adjust', render_window_level, source_key, *slider_value, clipped_key)
+        img_clipped = registry.get(clipped_key)
 
-    # Créer une nouvelle figure Plotly Express avec l'objet image
-    new_fig = px.imshow(img_clipped)
-    new_fig.update_layout(dragmode="drawrect")
+    # Créer une nouvelle figure qui référence l'image par URL, ou une figure à tuiles pour les très grandes images
+    if img_clipped.shape[0] * img_clipped.shape[1] > PYRAMID_MIN_PIXELS:
+        new_fig = pyramid_figure(clipped_key, pyramid_cache.get_or_build(clipped_key, img_clipped))
+    else:
+        new_fig = image_figure(clipped_key, img_clipped.shape)
+    # Les annotations déjà enregistrées sont redessinées sur la nouvelle figure
+    new_fig.update_layout(dragmode="drawrect", shapes=store.snapshot(session_id, source_key))
 
-    return (new_fig, img_clipped.tolist())
+    return (new_fig, clipped_key, source_key) + slider_update
     
 
+# Fonction callback pour passer à l'image précédente ou suivante du dossier (mode jeu de données)
+# L'image demandée est en général déjà préparée en arrière-plan ; les suivantes sont alors préchargées à leur tour
+if dataset is not None:
+    @callback(
+        Output('upload-id', 'data'),
+        Output('frame-index', 'data'),
+        Output('frame-label', 'children'),
+        Input('previous-image', 'n_clicks'),
+        Input('next-image', 'n_clicks'),
+        State('frame-index', 'data'),
+        prevent_initial_call=True,
+    )
+    def change_frame(previous_clicks, next_clicks, index):
+        step = 1 if ctx.triggered_id == 'next-image' else -1
+        index = min(max(index + step, 0), len(dataset) - 1)
+        image_key, _ = dataset.fetch(index)  # Déjà préparée en arrière-plan, ou en cours de préparation
+        dataset.prefetch(index)
+        return (image_key, index, frame_label(index))
+
+
 # Fonction callback pour capturer les annotations dessinées && mettre à jour l'histogramme de l'image en fonction de la région d'intérêt (ROI) sélectionnée
 @callback(
     Output('output-json', 'children'),  # Mise à jour d'un élément HTML pour afficher les données JSON
     Output("histogram", "figure"), # Mise à jour de l'histogramme de l'image
+    Output('shape-stats', 'data'),  # Mise à jour du tableau des statistiques par forme
+    Output('graph', 'figure', allow_duplicate=True),  # Formes enregistrées renvoyées à la figure si elle est désynchronisée
     Input('graph', 'relayoutData'),  # Déclenchement de la fonction à chaque fois qu'une annotation est dessinée
-    Input('image-store', 'data')
+    Input('image-store', 'data'),
+    State('session-id', 'data'),
+    State('image-id', 'data'),
+    State('red-slider', 'value'),
+    State('page-id', 'data'),
+    prevent_initial_call='initial_duplicate',
 )
-def save_annotations(relayout_data, img_data):
+def save_annotations(relayout_data, img_key, session_id, image_id, slider_value, page_id):
     print(relayout_data)
 
-    if img_data is not None:
-        img = np.array(img_data)
-        if relayout_data is not None and 'shapes' in relayout_data and len(relayout_data["shapes"]) > 0: # Vérifie si des annotations ont été trouvées
-                last_shape = relayout_data["shapes"][-1]
-                # shape coordinates are floats, we need to convert to ints for slicing
-                x0, y0 = int(last_shape["x0"]), int(last_shape["y0"])
-                x1, y1 = int(last_shape["x1"]), int(last_shape["y1"])
-                roi_img = img[y0:y1, x0:x1]  # Récupère la région d'intérêt (ROI) de l'image
+    seq = executor.begin(page_id, 'annotations')  # Numéro de cette requête dans la rafale d'événements de la page
+    changed = {}  # Formes ajoutées ou modifiées par cet événement, par position
+    resync = no_update  # Formes du stockage à redessiner quand la figure ne correspond plus au stockage
+    if ctx.triggered_id == 'graph':
+        # Lecture, traduction et application dans une seule transaction (BEGIN IMMEDIATE) : chaque événement est
+        # classé d'après l'état auquel il est appliqué, même si un autre onglet ou worker écrit en même temps
+        with store.batch():
+            # Traduction de relayoutData en événements ; la liste des formes n'est relue que si une forme a été effacée
+            shape_count = store.count(session_id, image_id)
+            events = parse_relayout(relayout_data, shape_count, lambda: store.snapshot(session_id, image_id))
+            if is_viewport_only(events):
+                return (no_update,) * 4  # Zoom ou déplacement : ni annotation ni histogramme à mettre à jour
+
+            # Application des seules formes modifiées, en un seul commit
+            for event in events:
+                if isinstance(event, ShapeAdded):
+                    store.append(session_id, image_id, event.shape)
+                    changed[event.index] = event.shape
+                elif isinstance(event, ShapeChanged):
+                    shape = store.update(session_id, image_id, event.index, event.changes)
+                    if shape is not None:  # Forme inconnue du stockage (par ex. dessinée avant le chargement de la page)
+                        changed[event.index] = shape
+                elif isinstance(event, ShapeErased):
+                    store.delete(session_id, image_id, event.index)
+                elif isinstance(event, ShapesReplaced):
+                    # Nombre de formes différent de celui du stockage (un autre onglet de la session a dessiné ou effacé) :
+                    # la liste de ce client ne remplace pas celle des autres, c'est la figure qui reprend les formes enregistrées
+                    resync = Patch()
+                    resync['layout']['shapes'] = store.snapshot(session_id, image_id)
+
+    # Les formes sont toujours enregistrées, mais une requête dépassée par une plus récente ne calcule ni ne renvoie ses résultats
+    latest = executor.is_latest(page_id, 'annotations', seq)
+
+    fig_hist = no_update  # L'histogramme n'est pas mis à jour si l'image n'est plus dans le registre
+    shape_rows = no_update
+    img = registry.get(img_key) if img_key is not None else None
+    source = registry.get(image_id) if image_id is not None else None
+    luts = None  # LUT de l'écrêtage affiché, appliquées aux comptes de l'image source (images uint8)
+    if source is not None and source.dtype != np.uint8:
+        img_key, img = image_id, source  # Grande dynamique : histogramme et statistiques sur les valeurs brutes, pas sur l'affichage uint8
+    if img is not None and latest:
+        hist_key, hist_img = img_key, img
+        if source is not None and source.dtype == np.uint8:
+            # Index de l'image source, construit une seule fois : un nouvel écrêtage ne reconstruit pas d'index,
+            # l'histogramme écrêté se déduit des comptes de la source à travers les LUT du réglage
+            hist_key, hist_img = image_id, source
+            if list(slider_value or (0, 255)) != [0, 255]:
+                stages = (clip(0, *slider_value),)
+                luts = np.rint(adjuster_cache.get(image_id, source).luts(stages)).astype(np.intp)
+        hist_index = index_cache.get(hist_key, hist_img)  # Index d'histogrammes cumulés de l'image
+        last_shape = list(changed.values())[-1] if changed else None
+        shape_kind = last_shape.get('type', 'path' if 'path' in last_shape else 'rect') if last_shape is not None else None
+        entry = shape_local_mask(last_shape, hist_img.shape) if shape_kind in ('circle', 'path') else None
+        if entry is not None:
+            # Cercle ou chemin fermé : ROI limitée aux pixels de la forme (masque local dans sa fenêtre englobante)
+            counts = hist_index.mask_histogram(*entry)
+            _, roi_mean, roi_std = hist_index.mask_stats(*entry)
         else:
-            roi_img = img  # Récupère l'image entière si aucune annotation n'est trouvée
-
-        # Crée un histogramme de l'image
-        fig_hist = create_histogram(roi_img)  
-
-    if relayout_data is not None and 'shapes' in relayout_data:  # Vérifie si des formes ont été dessinées
-        annotations = relayout_data['shapes']  # Récupère les annotations dessinées
-        with open('annotations.json', 'w') as f:  # Ouvre un fichier JSON en écriture
-            json.dump(annotations, f, indent=4)  # Écrit les annotations dans le fichier JSON avec un formatage indenté
-        
-        return (json.dumps(relayout_data), fig_hist)
-
-    elif relayout_data is not None and any(key.startswith('shapes[') for key in relayout_data.keys()):
-        # Expression régulière pour trouver le chiffre entre crochets de relayout_data.keys()
-        pattern = r'\[(\d+)\]'
+            if shape_kind == 'rect': # Vérifie si une annotation rectangulaire a été dessinée ou modifiée
+                # Coordonnées de la région d'intérêt (ROI), ordonnées et bornées par l'index
+                roi = (last_shape["x0"], last_shape["y0"], last_shape["x1"], last_shape["y1"])
+            else:
+                roi = (0, 0, img.shape[1], img.shape[0])  # Image entière si aucune surface n'est trouvée (ligne, chemin ouvert)
+            # Crée un histogramme de la ROI sans reparcourir ses pixels
+            counts = hist_index.histogram(*roi)
+            _, roi_mean, roi_std = hist_index.stats(*roi)
+        if luts is not None:
+            counts = remap_counts(counts, luts)  # Comptes de la source ramenés aux valeurs écrêtées
+            roi_mean, roi_std = counts_stats(counts)
+        # (les images à grande dynamique sont regroupées en 256 classes au plus sur l'étendue de leurs valeurs)
+        pixel_values, counts = hist_index.display_histogram(counts)
+        fig_hist = create_histogram(counts, roi_mean, roi_std, xaxis_title=histogram_axis_title(img), x=pixel_values)
+
+    if img is not None:
+        # Statistiques de toutes les formes : seules les formes concernées par les événements sont recomptées
+        # (le moteur suit chaque événement, même dépassé, pour rester synchronisé avec le stockage)
+        engine = stats_cache.get((page_id, img_key))
+        if engine is None or ctx.triggered_id != 'graph':
+            # Nouvelle version de l'image (téléversement, réglage) : toutes les formes en une passe
+            engine = stats_cache.put((page_id, img_key), ShapeStatistics(img, store.snapshot(session_id, image_id)))
+        else:
+            with engine.lock:  # Une autre requête de la session peut modifier le même moteur en parallèle
+                for event in events:
+                    if isinstance(event, ShapeAdded):
+                        engine.add_shape(event.shape)
+                    elif isinstance(event, ShapeChanged) and event.index in changed:
+                        engine.update_shape(event.index, changed[event.index])  # Forme complète après fusion des modifications
+                    elif isinstance(event, ShapeErased):
+                        engine.remove_shape(event.index)
+                    elif isinstance(event, ShapesReplaced):
+                        engine.set_shapes(store.snapshot(session_id, image_id))  # Formes du stockage, comme la figure
+                if len(engine.shapes) != store.count(session_id, image_id):
+                    engine.set_shapes(store.snapshot(session_id, image_id))  # Désynchronisation : recalcul complet
+        if latest:
+            shape_rows = engine.rows()
+
+    if changed:
+        return (json.dumps(changed), fig_hist, shape_rows, resync)  # Retourne les formes ajoutées ou modifiées
+    elif relayout_data is not None and 'shapes' in relayout_data:
+        return (json.dumps(relayout_data), fig_hist, shape_rows, resync)  # Forme effacée : retourne la liste restante
+    else:
+        return (json.dumps(obj=''), fig_hist, shape_rows, resync)  # Retourne une chaîne vide si aucune annotation n'a été trouvée
 
-        # Utilisation de re.search pour trouver le motif dans la chaîne
-        match = re.search(pattern, next(iter(relayout_data.keys())))
-        shape_index = int(match.group(1)) # Trouve et convertie en entier pour avoir l'index de notre figure
 
-        # Étape 1 : Charger les données existantes du fichier JSON
-        with open("annotations.json", "r") as f:    # Ouvre un fichier JSON en lecture
-            annotations = json.load(f)              # Charge le json dans annotations
+# Fonction callback pour surligner dans le tableau les formes qui contiennent le point cliqué de l'image
+# (test de l'index spatial du moteur de statistiques de la page, sans parcourir les formes)
+@callback(
+    Output('shape-stats', 'style_data_conditional'),
+    Input('graph', 'clickData'),
+    State('image-store', 'data'),
+    State('image-id', 'data'),
+    State('page-id', 'data'),
+    prevent_initial_call=True,
+)
+def highlight_shapes(click_data, img_key, image_id, page_id):
+    if not click_data or not click_data.get('points'):
+        return no_update
+    source = registry.get(image_id) if image_id is not None else None
+    if source is not None and source.dtype != np.uint8:
+        img_key = image_id  # Grande dynamique : le moteur porte sur les valeurs brutes (voir save_annotations)
+    engine = stats_cache.get((page_id, img_key))
+    if engine is None:
+        return []
+    point = click_data['points'][0]
+    return [
+        {"if": {"filter_query": f"{{shape}} = {index}"}, "backgroundColor": "#fff3b0"}
+        for index in engine.shapes_at(point['x'], point['y'])
+    ]
 
-        # Étape 2 : Modifier les données
-        for key in ['x0', 'x1', 'y0', 'y1']:
-            annotations[shape_index][key] = relayout_data[f"shapes[{shape_index}].{key}"]
 
-        # Étape 3 : Écrire les données modifiées dans le même fichier JSON
-        with open('annotations.json', 'w') as f:  # Ouvre un fichier JSON en écriture
-            json.dump(annotations, f, indent=4)  # Écrit les annotations dans le fichier JSON avec un formatage indenté
+# Fonction callback pour charger les tuiles du niveau adapté à la zone visible après un zoom ou un déplacement
+@callback(
+    Output('graph', 'figure', allow_duplicate=True),
+    Input('graph', 'relayoutData'),
+    State('image-store', 'data'),
+    prevent_initial_call=True,
+)
+def update_tiles(relayout_data, img_key):
+    pyramid = pyramid_cache.get(img_key)
+    if pyramid is None:
+        return no_update  # Image affichée en entier par image_figure
+
+    viewport = None
+    for event in parse_relayout(relayout_data):
+        if isinstance(event, ViewportChanged):
+            x_range, y_range = event.ranges.get('xaxis'), event.ranges.get('yaxis')
+            # Une borne manquante revient à afficher toute l'étendue de l'axe
+            viewport = (x_range if x_range and None not in x_range else None,
+                        y_range if y_range and None not in y_range else None)
+        elif isinstance(event, Autorange):
+            viewport = (None, None)
+    if viewport is None:
+        return no_update  # Pas de changement de vue (dessin ou modification d'une forme)
+
+    # Seules les images de la mise en page sont remplacées, les formes et le zoom restent inchangés
+    patched_fig = Patch()
+    patched_fig['layout']['images'] = tile_images(img_key, pyramid, *viewport)
+    return patched_fig
+
+
+# Fonction callback pour exporter une copie des annotations de l'image affichée
+@callback(
+    Output('export-download', 'data'),
+    Input('export-button', 'n_clicks'),
+    State('session-id', 'data'),
+    State('image-id', 'data'),
+    prevent_initial_call=True,
+)
+def export_annotations(n_clicks, session_id, image_id):
+    annotations = store.snapshot(session_id, image_id)
+    return dict(content=json.dumps(annotations, indent=4), filename='annotations.json')
 
-        return (json.dumps(annotations), fig_hist)  # Retourne un message de succès si les annotations sont sauvegardées
-    else:
-        return (json.dumps(obj=''), fig_hist)  # Retourne une chaîne vide si aucune annotation n'a été trouvée
+# Fonction callback pour exporter les masques des annotations de l'image affichée au format COCO (RLE)
+@callback(
+    Output('export-coco-download', 'data'),
+    Input('export-coco-button', 'n_clicks'),
+    State('session-id', 'data'),
+    State('image-id', 'data'),
+    prevent_initial_call=True,
+)
+def export_coco(n_clicks, session_id, image_id):
+    img = registry.get(image_id)
+    if img is None:
+        return no_update
+    document = coco_document(store.snapshot(session_id, image_id), img.shape, file_name=f"{image_id}.png")
+    return dict(content=json.dumps(document), filename='annotations_coco.json')
 
 # Démarrage de l'application en mode débogage si ce script est exécuté en tant que programme principal
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+# Chaîne de réglages d'image (écrêtage, gamma, étirement de contraste, égalisation) par canal
+# Toutes les étapes sont ponctuelles : elles sont fusionnées en une seule table de correspondance
+# (LUT) de 256 entrées par canal, appliquée à l'image en une seule passe. Rien n'est calculé avant
+# l'appel à `apply`, et les LUT intermédiaires sont mémorisées par préfixe d'étapes : modifier la
+# dernière étape ne recalcule pas celles qui la précèdent.
+# Les images à grande dynamique (uint16, float32) sont affichées par fenêtre/niveau : une LUT d'une
+# entrée par classe de valeur (65 536 pour uint16, voir histogram_index.ValueScale) les ramène en uint8.
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from histogram_index import count_values, N_BINS, ValueScale
+from image_registry import make_key
+from shared_store import shared_store
+
+
+# Fonctions pour décrire les étapes : de simples tuples, utilisables comme clés de cache
+def clip(channel, low, high):
+    return ("clip", channel, low, high)
+
+
+def gamma(channel, value):
+    return ("gamma", channel, value)
+
+
+def stretch(channel, low, high):
+    return ("stretch", channel, low, high)
+
+
+def equalize(channel):
+    return ("equalize", channel)
+
+
+# Fonction pour appliquer une étape à la LUT d'un canal ; `hist` est l'histogramme du canal à ce stade
+def apply_stage(stage, lut, hist):
+    kind = stage[0]
+    if kind == "clip":
+        return np.clip(lut, stage[2], stage[3])
+    if kind == "gamma":
+        return 255.0 * (lut / 255.0) ** stage[2]
+    if kind == "stretch":
+        low, high = stage[2], stage[3]
+        return np.clip((lut - low) * 255.0 / max(high - low, 1), 0, 255)
+    if kind == "equalize":
+        # Égalisation d'histogramme : la fonction de répartition sert de LUT
+        cdf = np.cumsum(hist)
+        cdf_min = cdf[np.nonzero(cdf)[0][0]] if cdf[-1] > 0 else 0
+        eq = np.rint((cdf - cdf_min) * 255.0 / max(cdf[-1] - cdf_min, 1))
+        return eq[np.rint(lut).astype(np.intp)]
+    raise ValueError(f"Étape de réglage inconnue : {kind!r}")
+
+
+# Fonction pour calculer la LUT fenêtre/niveau d'une image : classe de valeur -> niveau uint8,
+# les valeurs de [low, high] étant étalées sur 0-255
+def window_level_lut(scale, low, high):
+    values = scale.values(np.arange(scale.n_bins))
+    return np.clip(np.rint((values - low) * 255.0 / ((high - low) or 1.0)), 0, 255).astype(np.uint8)
+
+
+# Fonction pour afficher une image à grande dynamique en uint8 : une seule lecture à travers la LUT
+# `scale` est celui de l'image entière quand `img` n'en est qu'une version réduite (aperçu)
+def window_level(img, low, high, scale=None):
+    scale = ValueScale(img) if scale is None else scale
+    return window_level_lut(scale, low, high)[scale.codes(img)]
+
+
+# Fonction pour construire la clé de la version affichée d'une image à grande dynamique
+def window_key(source_key, low, high):
+    return make_key(source_key, window=(float(low), float(high)))
+
+
+class ImageAdjuster:
+    # Évalue paresseusement des chaînes d'étapes sur une image uint8 (H, W) ou (H, W, C)
+    def __init__(self, img, max_cached=64):
+        self.img = img if img.ndim == 3 else img[:, :, np.newaxis]
+        self.channels = self.img.shape[2]
+        self.max_cached = max_cached
+        self._base_hist = None
+        self._luts = OrderedDict()  # Préfixe d'étapes -> LUT flottantes (C, 256)
+        self._lock = threading.Lock()
+
+    # Histogramme de l'image source, calculé seulement si une égalisation le demande
+    def base_hist(self):
+        if self._base_hist is None:
+            self._base_hist = count_values(self.img)
+        return self._base_hist
+
+    # LUT fusionnées (C, 256) de la chaîne `stages`, en repartant du plus long préfixe déjà mémorisé
+    def luts(self, stages):
+        stages = tuple(stages)
+        with self._lock:
+            start = len(stages)
+            while start > 0 and stages[:start] not in self._luts:
+                start -= 1
+            if start > 0:
+                lut = self._luts[stages[:start]]
+                self._luts.move_to_end(stages[:start])
+            else:
+                lut = np.tile(np.arange(N_BINS, dtype=float), (self.channels, 1))
+
+        for k in range(start, len(stages)):
+            stage = stages[k]
+            channel = stage[1]
+            hist = None
+            if stage[0] == "equalize":
+                # Histogramme du canal après les étapes précédentes, déduit de l'histogramme source sans relire l'image
+                current = np.rint(lut[channel]).astype(np.intp)
+                hist = np.bincount(current, weights=self.base_hist()[channel], minlength=N_BINS)
+            lut = lut.copy()
+            lut[channel] = apply_stage(stage, lut[channel], hist)
+            with self._lock:
+                self._luts[stages[:k + 1]] = lut
+                while len(self._luts) > self.max_cached:
+                    self._luts.popitem(last=False)
+        return lut
+
+    # Image réglée : une seule lecture de chaque canal modifié à travers sa LUT uint8
+    # `img` permet d'appliquer les LUT de l'image source à une version réduite (aperçu) de celle-ci
+    def apply(self, stages, img=None):
+        img = self.img if img is None else (img if img.ndim == 3 else img[:, :, np.newaxis])
+        if not stages:
+            return img if self.channels > 1 else img[:, :, 0]
+        luts = np.rint(self.luts(stages)).astype(np.uint8)
+        modified = {stage[1] for stage in stages}
+        out = np.empty_like(img)
+        for channel in range(self.channels):
+            if channel in modified:
+                out[:, :, channel] = luts[channel][img[:, :, channel]]
+            else:
+                out[:, :, channel] = img[:, :, channel]
+        return out if self.channels > 1 else out[:, :, 0]
+
+
+class AdjusterCache:
+    # Garde un ImageAdjuster (et donc ses LUT mémorisées) par image source
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._adjusters = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Récupère l'ImageAdjuster de l'image `key`, en le créant à partir de `img` s'il n'existe pas encore
+    def get(self, key, img):
+        with self._lock:
+            adjuster = self._adjusters.get(key)
+            if adjuster is None:
+                adjuster = self._adjusters[key] = ImageAdjuster(img)
+                while len(self._adjusters) > self.max_entries:
+                    self._adjusters.popitem(last=False)
+            else:
+                self._adjusters.move_to_end(key)
+            return adjuster
+
+
+# Cache partagé par les applications du dossier
+adjuster_cache = AdjusterCache()
+
+
+# Fonction exécutée dans un processus de calcul (voir latest_executor.py) : lit l'image source dans le stockage
+# partagé et y écrit sa version réglée sous `out_key`, que le processus Dash rouvre ensuite en mémoire mappée
+def render_adjusted(source_key, stages, out_key):
+    if shared_store.get(out_key) is None:
+        img = shared_store.get(source_key)
+        if img is None:
+            raise KeyError(f"Image absente du stockage partagé : {source_key!r}")
+        shared_store.put(out_key, adjuster_cache.get(source_key, img).apply(stages))
+    return out_key
+
+
+# Fonction exécutée dans un processus de calcul, comme render_adjusted, pour la fenêtre/niveau d'une image à grande dynamique
+def render_window_level(source_key, low, high, out_key):
+    if shared_store.get(out_key) is None:
+        img = shared_store.get(source_key)
+        if img is None:
+            raise KeyError(f"Image absente du stockage partagé : {source_key!r}")
+        shared_store.put(out_key, window_level(img, low, high))
+    return out_key
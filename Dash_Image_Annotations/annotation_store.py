@@ -0,0 +1,131 @@
+# Stockage persistant des annotations dans SQLite (mode WAL)
+# Chaque forme est une ligne indexée par (session, image, position) : ajouter ou modifier une forme
+# ne réécrit pas les autres, plusieurs processus (workers gunicorn) ou onglets peuvent écrire en même
+# temps sans perdre de mise à jour, et une lecture voit toujours un état cohérent sans bloquer les écritures.
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shapes (
+    session_id  TEXT    NOT NULL,
+    image_id    TEXT    NOT NULL,
+    shape_index INTEGER NOT NULL,
+    shape       TEXT    NOT NULL,
+    PRIMARY KEY (session_id, image_id, shape_index)
+) WITHOUT ROWID
+"""
+
+
+class AnnotationStore:
+    def __init__(self, path="annotations.db"):
+        self.path = path
+        self._local = threading.local()  # Une connexion SQLite par thread
+        with self._transaction() as conn:
+            conn.execute(SCHEMA)
+
+    # Connexion du thread courant, ouverte en mode WAL et en autocommit (transactions explicites)
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    # Transaction d'écriture ; les transactions imbriquées rejoignent la transaction englobante
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        if self._local.depth > 0:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        # BEGIN IMMEDIATE prend le verrou d'écriture tout de suite : pas de lecture-modification-écriture concurrente
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    # Regroupe plusieurs opérations en un seul commit
+    def batch(self):
+        return self._transaction()
+
+    # Nombre de formes enregistrées pour une image
+    def count(self, session_id, image_id):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM shapes WHERE session_id = ? AND image_id = ?", (session_id, image_id)
+        ).fetchone()
+        return row[0]
+
+    # Ajoute une forme à la fin de la liste et renvoie sa position
+    def append(self, session_id, image_id, shape):
+        with self._transaction() as conn:
+            (index,) = conn.execute(
+                "SELECT COALESCE(MAX(shape_index) + 1, 0) FROM shapes WHERE session_id = ? AND image_id = ?",
+                (session_id, image_id),
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO shapes VALUES (?, ?, ?, ?)", (session_id, image_id, index, json.dumps(shape))
+            )
+        return index
+
+    # Modifie certains champs d'une forme (par ex. x0, y1 ou path) sans toucher aux autres formes
+    def update(self, session_id, image_id, index, changes):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT shape FROM shapes WHERE session_id = ? AND image_id = ? AND shape_index = ?",
+                (session_id, image_id, index),
+            ).fetchone()
+            if row is None:
+                return None
+            shape = json.loads(row[0])
+            shape.update(changes)
+            conn.execute(
+                "UPDATE shapes SET shape = ? WHERE session_id = ? AND image_id = ? AND shape_index = ?",
+                (json.dumps(shape), session_id, image_id, index),
+            )
+        return shape
+
+    # Supprime une forme ; les formes suivantes reculent d'une position, comme dans la figure Plotly
+    def delete(self, session_id, image_id, index):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM shapes WHERE session_id = ? AND image_id = ? AND shape_index = ?",
+                (session_id, image_id, index),
+            )
+            # Renumérotation en deux temps (via des valeurs négatives) pour ne pas violer la clé primaire
+            conn.execute(
+                "UPDATE shapes SET shape_index = -shape_index WHERE session_id = ? AND image_id = ? AND shape_index > ?",
+                (session_id, image_id, index),
+            )
+            conn.execute(
+                "UPDATE shapes SET shape_index = -shape_index - 1 WHERE session_id = ? AND image_id = ? AND shape_index < 0",
+                (session_id, image_id),
+            )
+
+    # Supprime toutes les formes d'une image
+    def clear(self, session_id, image_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM shapes WHERE session_id = ? AND image_id = ?", (session_id, image_id))
+
+    # Copie cohérente des formes d'une image (pour l'export), sans bloquer les écritures en cours
+    def snapshot(self, session_id, image_id):
+        rows = self._connection().execute(
+            "SELECT shape FROM shapes WHERE session_id = ? AND image_id = ? ORDER BY shape_index",
+            (session_id, image_id),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,108 @@
+// Téléversement par morceaux (voir chunked_upload.py)
+// Toute zone dont l'identifiant figure dans UPLOAD_TARGETS ouvre un sélecteur de fichier au clic et accepte
+// le glisser-déposer. Le fichier est envoyé brut, morceau par morceau, à /upload/<id> ; après une erreur
+// réseau, l'envoi reprend au nombre d'octets déjà reçus par le serveur. Une fois l'image décodée, sa clé est
+// écrite dans le dcc.Store indiqué, ce qui déclenche les callbacks Dash.
+(function () {
+    // Zone de dépôt -> [dcc.Store qui reçoit la clé de l'image, élément qui affiche la progression]
+    var UPLOAD_TARGETS = {
+        "upload-image": ["upload-id", "upload-progress"],
+    };
+    var CHUNK_BYTES = 4 * 1024 * 1024;
+    var MAX_RETRIES = 5;
+
+    function setProps(id, props) {
+        if (document.getElementById(id)) {
+            window.dash_clientside.set_props(id, props);
+        }
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    // Identifiant stable pour un même fichier : le relancer après une interruption reprend le même téléversement
+    async function uploadId(file) {
+        var text = [file.name, file.size, file.lastModified].join("|");
+        var digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+        return Array.from(new Uint8Array(digest).slice(0, 16))
+            .map(function (b) { return b.toString(16).padStart(2, "0"); }).join("");
+    }
+
+    async function getStatus(url) {
+        var response = await fetch(url);
+        if (!response.ok) throw new Error("HTTP " + response.status);
+        return response.json();
+    }
+
+    async function upload(file, storeId, progressId) {
+        var url = "/upload/" + await uploadId(file);
+        var status = await getStatus(url);
+        var retries = 0;
+        while (status.state === "receiving" && status.offset < file.size) {
+            setProps(progressId, {children: "Uploading " + Math.floor(100 * status.offset / file.size) + " %"});
+            var chunk = file.slice(status.offset, status.offset + CHUNK_BYTES);
+            try {
+                var response = await fetch(url + "?offset=" + status.offset, {method: "PUT", body: chunk});
+                if (response.status === 413) throw new Error("File too large");
+                // 409 : position inattendue, la réponse indique où reprendre
+                if (!response.ok && response.status !== 409) throw new Error("HTTP " + response.status);
+                status = await response.json();
+                retries = 0;
+            } catch (e) {
+                if (e.message === "File too large" || ++retries > MAX_RETRIES) throw e;
+                await sleep(1000 * retries);
+                status = await getStatus(url);  // Reprise à partir des octets déjà reçus
+            }
+        }
+        if (status.state === "receiving") {
+            var done = await fetch(url + "/complete?size=" + file.size, {method: "POST"});
+            status = await done.json();
+            if (status.state === "receiving") throw new Error("Incomplete upload, select the file again to resume");
+        }
+        setProps(progressId, {children: "Decoding…"});
+        while (status.state === "decoding") {
+            await sleep(300);
+            status = await getStatus(url);
+        }
+        if (status.error) throw new Error(status.error);
+        setProps(progressId, {children: file.name});
+        setProps(storeId, {data: status.image_id});
+    }
+
+    function start(file, target) {
+        var ids = UPLOAD_TARGETS[target.id];
+        upload(file, ids[0], ids[1]).catch(function (e) {
+            setProps(ids[1], {children: "Upload failed: " + e.message});
+        });
+    }
+
+    function findTarget(node) {
+        while (node && node !== document) {
+            if (node.id && UPLOAD_TARGETS.hasOwnProperty(node.id)) return node;
+            node = node.parentNode;
+        }
+        return null;
+    }
+
+    document.addEventListener("click", function (event) {
+        var target = findTarget(event.target);
+        if (!target) return;
+        var input = document.createElement("input");
+        input.type = "file";
+        input.accept = "image/*";
+        input.onchange = function () {
+            if (input.files.length) start(input.files[0], target);
+        };
+        input.click();
+    });
+    document.addEventListener("dragover", function (event) {
+        if (findTarget(event.target)) event.preventDefault();
+    });
+    document.addEventListener("drop", function (event) {
+        var target = findTarget(event.target);
+        if (!target) return;
+        event.preventDefault();
+        if (event.dataTransfer.files.length) start(event.dataTransfer.files[0], target);
+    });
+})();
@@ -0,0 +1,97 @@
+# Calcul en ligne de commande des statistiques des ROI d'un dossier d'images, sans l'interface Dash
+# Les formes sont lues dans la base d'annotations de l'outil (mode jeu de données, voir image_dataset.py)
+# ou dans un fichier JSON placé à côté de chaque image (<nom>.json, au format de l'export de l'outil).
+# Chaque image est traitée par un processus du pool avec le même moteur que le tableau de l'interface
+# (shape_statistics.py) ; le résultat est un seul fichier en colonnes, une ligne par forme.
+#
+# Exemple : python batch_roi_stats.py images/ --db annotations.db -o stats.parquet --histograms
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from annotation_store import AnnotationStore
+from histogram_index import N_BINS
+from image_dataset import dataset_session_id, file_signature_key, list_images
+from image_registry import supported_array
+from shape_statistics import ShapeStatistics
+
+# Base d'annotations ouverte une fois par processus du pool
+_stores = {}
+
+
+# Fonction pour lire les formes d'une image : base d'annotations de l'outil, ou fichier JSON à côté de l'image
+def load_shapes(path, db_path=None):
+    if db_path is not None:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = AnnotationStore(db_path)
+        return store.snapshot(dataset_session_id(os.path.dirname(path)), file_signature_key(path))
+    sidecar = os.path.splitext(path)[0] + ".json"
+    if not os.path.exists(sidecar):
+        return []
+    with open(sidecar) as f:
+        shapes = json.load(f)
+    return shapes.get("shapes", []) if isinstance(shapes, dict) else shapes
+
+
+# Fonction exécutée par un processus du pool : une ligne de statistiques par forme de l'image
+def image_rows(path, db_path=None, histograms=False):
+    shapes = load_shapes(path, db_path)
+    if not shapes:
+        return []
+    img = supported_array(np.array(Image.open(path)))
+    engine = ShapeStatistics(img, shapes)
+    rows = engine.rows()
+    counts = engine.histograms()  # None pour les images à grande dynamique : seuls les moments sont gardés
+    for index, row in enumerate(rows):
+        row["image"] = os.path.basename(path)
+        if histograms and counts is not None:
+            for channel, channel_counts in enumerate(counts[index]):
+                row.update({f"hist_{channel}_{value}": int(n) for value, n in enumerate(channel_counts)})
+    return rows
+
+
+# Fonction pour traiter toutes les images d'un dossier en parallèle et renvoyer le tableau des statistiques
+def batch_statistics(folder, db_path=None, histograms=False, workers=None):
+    files = list_images(folder)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Lots de plusieurs images par tâche pour limiter les échanges entre processus
+        chunksize = max(1, len(files) // (4 * (workers or os.cpu_count() or 1)))
+        results = pool.map(image_rows, files, [db_path] * len(files), [histograms] * len(files), chunksize=chunksize)
+        rows = [row for image_result in results for row in image_result]
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df = df[["image"] + [column for column in df.columns if column != "image"]]
+    return df
+
+
+# Fonction pour écrire le tableau en Parquet ou en CSV selon l'extension du fichier de sortie
+def write_table(df, output):
+    if output.endswith(".parquet"):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-ROI histograms and statistics for a folder of annotated images")
+    parser.add_argument("folder", help="folder of images")
+    parser.add_argument("--db", help="annotation database of the tool (dataset mode); default: <image>.json files")
+    parser.add_argument("-o", "--output", default="roi_stats.csv", help="output file (.csv or .parquet)")
+    parser.add_argument("--histograms", action="store_true", help=f"add the {N_BINS} counts of each channel (8-bit images)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    df = batch_statistics(args.folder, args.db, args.histograms, args.workers)
+    write_table(df, args.output)
+    print(f"{len(df)} ROI written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
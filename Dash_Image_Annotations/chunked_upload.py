@@ -0,0 +1,180 @@
+# Téléversement par morceaux, avec reprise, écrit directement sur disque
+# Avec dcc.Upload, le fichier arrive en une seule chaîne base64 dans la requête du callback (1,33 fois
+# sa taille) et se retrouve plusieurs fois en mémoire. Ici le navigateur (assets/chunked_upload.js)
+# envoie le fichier brut par morceaux à une route Flask qui les ajoute à un fichier du répertoire de
+# spool. Après une interruption, il demande le nombre d'octets déjà reçus et reprend à partir de là.
+# Le décodage se fait dans un thread à part, hors de la requête ; le callback ne reçoit que la clé de l'image.
+#
+# Fichiers du spool pour un téléversement <id> :
+#   <id>.part      octets reçus jusqu'ici
+#   <id>.decoding  fichier complet en cours de décodage (renommé depuis .part : un seul décodage par fichier)
+#   <id>.json      résultat du décodage : {"image_id": clé} ou {"error": message}
+# L'état est sur disque : tous les workers du serveur voient le même téléversement. Les écritures dans <id>.part
+# se font sous un verrou fcntl.flock : deux PUT simultanés (requête répétée par le navigateur) ne peuvent pas
+# ajouter deux fois les octets de la même position.
+import fcntl
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, jsonify, request
+
+# Répertoire par défaut (modifiable par la variable d'environnement DASH_UPLOAD_SPOOL)
+DEFAULT_ROOT = os.environ.get("DASH_UPLOAD_SPOOL", os.path.join(tempfile.gettempdir(), "dash_upload_spool"))
+DEFAULT_MAX_BYTES = 1024 ** 3  # Taille maximale d'un fichier
+DEFAULT_CHUNK_BYTES = 16 * 1024 ** 2  # Taille maximale d'un morceau
+DEFAULT_MAX_AGE = 24 * 3600  # Les téléversements abandonnés sont supprimés après ce délai (en secondes)
+COPY_BYTES = 1024 ** 2  # Taille des lectures dans le flux de la requête
+
+# Identifiants acceptés (choisis par le navigateur) : pas de séparateur de chemin possible
+UPLOAD_ID = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+
+class UploadSpool:
+    # `decode(path)` lit le fichier complet et renvoie la clé de l'image (appelé dans un thread de décodage)
+    # `exists(key)` indique si une image décodée est toujours disponible : un résultat dont l'image a été évincée
+    # est supprimé et le téléversement recommence au lieu de renvoyer une clé qui ne mène plus à rien
+    def __init__(self, decode, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                 max_age=DEFAULT_MAX_AGE, max_workers=2, exists=None):
+        self.decode = decode
+        self.exists = exists
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.max_age = max_age
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, upload_id, suffix):
+        return os.path.join(self.root, f"{upload_id}.{suffix}")
+
+    # État d'un téléversement : résultat du décodage, décodage en cours ou nombre d'octets déjà reçus
+    def status(self, upload_id):
+        result_path = self.path(upload_id, "json")
+        try:
+            with open(result_path) as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            result = None
+        if result is not None:
+            if "image_id" not in result or self.exists is None or self.exists(result["image_id"]):
+                return dict(result, state="done")
+            try:
+                os.remove(result_path)  # Image évincée depuis le décodage : le fichier doit être renvoyé
+            except FileNotFoundError:
+                pass
+        if os.path.exists(self.path(upload_id, "decoding")):
+            return {"state": "decoding"}
+        try:
+            offset = os.path.getsize(self.path(upload_id, "part"))
+        except FileNotFoundError:
+            offset = 0
+        return {"state": "receiving", "offset": offset}
+
+    # Ajoute un morceau lu dans `stream` à la position `offset`, qui doit être le nombre d'octets déjà reçus
+    # Renvoie le nouveau nombre d'octets reçus, ou None si `offset` ne correspond pas (le client doit reprendre)
+    def write_chunk(self, upload_id, offset, stream, length):
+        if length > self.chunk_bytes or offset + length > self.max_bytes:
+            abort(413)
+        if offset == 0:
+            self._cleanup()
+        path = self.path(upload_id, "part")
+        with open(path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Libéré à la fermeture du fichier
+            if not self._still_part(path, f) or f.seek(0, os.SEEK_END) != offset:
+                return None
+            remaining = length
+            while remaining > 0:
+                block = stream.read(min(COPY_BYTES, remaining))
+                if not block:
+                    break  # Connexion interrompue : les octets reçus restent, le client reprendra
+                f.write(block)
+                remaining -= len(block)
+            return f.tell()
+
+    # Vérifie que le fichier ouvert est toujours <id>.part (il a pu être renommé pour le décodage avant le verrou)
+    def _still_part(self, path, f):
+        try:
+            return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    # Termine un téléversement de `size` octets et lance son décodage en arrière-plan
+    def complete(self, upload_id, size):
+        status = self.status(upload_id)
+        if status["state"] != "receiving":
+            return status  # Déjà terminé (par exemple par une requête répétée)
+        if status["offset"] != size:
+            return status  # Fichier incomplet : le client doit reprendre à `offset`
+        try:
+            with open(self.path(upload_id, "part"), "rb") as f:
+                # Sous le verrou des écritures : le fichier n'est pas renommé pendant qu'un morceau y est ajouté
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if os.fstat(f.fileno()).st_size != size:
+                    return self.status(upload_id)
+                os.replace(self.path(upload_id, "part"), self.path(upload_id, "decoding"))
+        except FileNotFoundError:
+            return self.status(upload_id)  # Un autre worker a pris le fichier
+        self._pool.submit(self._decode, upload_id)
+        return {"state": "decoding"}
+
+    def _decode(self, upload_id):
+        path = self.path(upload_id, "decoding")
+        try:
+            result = {"image_id": self.decode(path)}
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        tmp_path = self.path(upload_id, f"{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self.path(upload_id, "json"))
+        os.remove(path)
+
+    # Supprime les fichiers du spool plus anciens que `max_age` (téléversements abandonnés, résultats déjà lus)
+    def _cleanup(self):
+        limit = time.time() - self.max_age
+        for entry in os.scandir(self.root):
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+# Fonction pour ajouter au serveur Flask de Dash les routes de téléversement :
+#   GET  <prefix>/<id>                  état (et nombre d'octets reçus, pour reprendre)
+#   PUT  <prefix>/<id>?offset=N         morceau suivant, corps brut de la requête
+#   POST <prefix>/<id>/complete?size=N  fin du téléversement, lance le décodage
+def register_upload_route(server, spool, prefix="/upload"):
+    def check_id(upload_id):
+        if not UPLOAD_ID.fullmatch(upload_id):
+            abort(404)
+
+    def upload_status(upload_id):
+        check_id(upload_id)
+        return jsonify(spool.status(upload_id))
+
+    def upload_chunk(upload_id):
+        check_id(upload_id)
+        offset = request.args.get("offset", type=int)
+        length = request.content_length
+        if offset is None or length is None:
+            abort(400)
+        received = spool.write_chunk(upload_id, offset, request.stream, length)
+        if received is None:
+            return jsonify(spool.status(upload_id)), 409  # Position inattendue : l'état indique où reprendre
+        return jsonify({"state": "receiving", "offset": received})
+
+    def upload_complete(upload_id):
+        check_id(upload_id)
+        size = request.args.get("size", type=int)
+        if size is None:
+            abort(400)
+        return jsonify(spool.complete(upload_id, size))
+
+    server.add_url_rule(prefix + "/<upload_id>", "upload_status", upload_status, methods=["GET"])
+    server.add_url_rule(prefix + "/<upload_id>", "upload_chunk", upload_chunk, methods=["PUT"])
+    server.add_url_rule(prefix + "/<upload_id>/complete", "upload_complete", upload_complete, methods=["POST"])
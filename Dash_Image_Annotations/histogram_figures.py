@@ -0,0 +1,61 @@
+# Figures d'histogrammes calculées côté serveur
+# Les pixels ne sont plus envoyés au navigateur pour y être regroupés en classes : le serveur compte les
+# 256 valeurs de chaque canal (np.bincount, tous les canaux en une passe grâce à un décalage de 256 par
+# canal) et la figure ne contient que ces comptes, sous forme de barres. Les images à grande dynamique
+# arrivent déjà regroupées (voir HistogramIndex.display_histogram), avec la valeur de chaque classe dans `x`.
+import numpy as np
+import plotly.graph_objects as go
+
+from histogram_index import count_values, N_BINS
+
+# Nom et couleur des traces selon le nombre de canaux
+CHANNEL_STYLES = {
+    1: [("Intensity", "#636363")],
+    3: [("Red", "#FF0000"), ("Green", "#00FF00"), ("Blue", "#0000FF")],
+}
+
+
+# Fonction pour compter les valeurs de chaque canal d'une image (H, W) ou (H, W, C) : tableau (C, 256)
+def channel_histogram(img):
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[:, :, np.newaxis]
+    return count_values(img[:, :, :3])
+
+
+# Fonction pour créer la figure d'histogramme à partir des comptes (C, n), avec les statistiques du ROI si fournies
+# `x` donne la valeur de chaque classe (par défaut les 256 valeurs uint8)
+def create_histogram(counts, mean=None, std=None,
+                     title='Number of pixels as a function of channel intensity value',
+                     xaxis_title='8bit pixel values', yaxis_title='count in ROI', x=None):
+    counts = np.atleast_2d(counts)
+    pixel_values = np.arange(N_BINS) if x is None else x
+    styles = CHANNEL_STYLES.get(len(counts), CHANNEL_STYLES[3])
+
+    fig_hist = go.Figure()
+    for channel_counts, (name, color) in zip(counts, styles):
+        fig_hist.add_trace(go.Bar(
+            x=pixel_values,
+            y=channel_counts,
+            name=name, # name used in legend and hover labels
+            marker_color=color,
+        ))
+
+    # Ajout des statistiques du ROI dans le titre lorsqu'elles sont fournies
+    if mean is not None:
+        names = "/".join(name[0] for name, _ in styles[:len(mean)])
+        title += '<br><sup>mean {0}: {1} — std {0}: {2}</sup>'.format(
+            names, " / ".join(f"{m:.4g}" for m in mean[:3]), " / ".join(f"{s:.4g}" for s in std[:3])
+        )
+
+    # Mise en forme de la figure
+    fig_hist.update_layout(
+        title=title,
+        xaxis_title=xaxis_title,
+        yaxis_title=yaxis_title,
+        barmode='overlay',
+        bargap=0,
+    )
+    fig_hist.update_traces(opacity=0.75)
+
+    return fig_hist
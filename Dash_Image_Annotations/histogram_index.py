@@ -0,0 +1,296 @@
+# Index d'histogrammes cumulés pour calculer l'histogramme, la moyenne et l'écart type
+# d'un rectangle quelconque sans reparcourir tous ses pixels.
+#
+# - Histogrammes, sommes et sommes des carrés cumulés par blocs de `block` x `block` pixels (summed-area
+#   tables sur la grille de blocs) : l'intérieur du rectangle aligné sur la grille se lit en 4 accès,
+#   seuls les pixels de la bordure (au plus `block` pixels d'épaisseur) sont recomptés. Le coût ne dépend
+#   donc plus de l'aire du ROI mais de son périmètre, avec une mémoire de (H/block) x (W/block) x 256
+#   compteurs au lieu de H x W x 256, et sans table de la taille de l'image : l'index d'une très grande
+#   image (pyramide de tuiles) reste de quelques dizaines de Mo.
+# - Images à grande dynamique (uint16, float32) : les valeurs sont regroupées en classes (ValueScale),
+#   65 536 classes pour uint16 (la valeur elle-même) et des classes régulières entre le minimum et le
+#   maximum pour les flottants. Des histogrammes par blocs sur ces classes prendraient 256 fois plus de
+#   mémoire : les blocs comptent donc les classes d'affichage (au plus 256 classes régulières sur les
+#   valeurs occupées, voir display_histogram), et le rectangle se lit comme pour une image uint8.
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from shared_store import shared_store
+
+N_BINS = 256
+U16_BINS = 65536  # Une classe par valeur uint16
+FLOAT_BINS = 4096  # Classes régulières entre le minimum et le maximum d'une image flottante
+BLOCK = 64  # Côté (en pixels) des blocs des histogrammes cumulés
+
+
+# Fonction pour compter les valeurs de chaque canal d'une fenêtre en un seul np.bincount (décalage de n_bins par canal)
+def count_values(window, n_bins=N_BINS):
+    n_channels = window.shape[-1]
+    offsets = np.arange(n_channels, dtype=np.intp) * n_bins
+    flat = (window.astype(np.intp) + offsets).ravel()
+    return np.bincount(flat, minlength=n_channels * n_bins).reshape(n_channels, n_bins)
+
+
+# Fonction pour ramener des comptes (C, n_bins) à travers des LUT (C, n_bins) d'entiers : comptes de l'image réglée
+# (un histogramme de l'image source et les LUT suffisent, sans relire ni recalculer l'image réglée)
+def remap_counts(counts, luts, n_bins=N_BINS):
+    return np.stack([
+        np.bincount(lut, weights=channel_counts, minlength=n_bins) for lut, channel_counts in zip(luts, counts)
+    ]).astype(np.int64)
+
+
+# Fonction pour calculer la moyenne et l'écart type par canal à partir de comptes (C, n_bins) sur les valeurs 0 à n_bins - 1
+def counts_stats(counts):
+    values = np.arange(counts.shape[1], dtype=float)
+    n = counts.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (counts * values).sum(axis=1) / n
+        mean_sq = (counts * values ** 2).sum(axis=1) / n
+    return mean, np.sqrt(np.maximum(mean_sq - mean * mean, 0))
+
+
+class ValueScale:
+    # Correspondance entre les valeurs d'une image et les classes de ses histogrammes
+    # uint8 et uint16 : la classe est la valeur ; float32 : FLOAT_BINS classes régulières sur [lo, hi]
+    # `lo` et `hi` sont les valeurs extrêmes de l'image (bornes du curseur et de la fenêtre d'affichage)
+    def __init__(self, img):
+        self.dtype = img.dtype
+        self.integer = img.dtype.kind in "ui"
+        if img.dtype == np.uint8:
+            self.n_bins, self.lo, self.hi = N_BINS, 0.0, 255.0
+            return
+        self.n_bins = U16_BINS if self.integer else FLOAT_BINS
+        finite = img if self.integer else img[np.isfinite(img)]
+        self.lo, self.hi = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+
+    # Classes des valeurs de `img` (l'image elle-même pour les entiers, uint16 pour les flottants)
+    def codes(self, img):
+        if self.integer:
+            return img
+        step = (self.hi - self.lo) / (self.n_bins - 1) or 1.0
+        codes = np.nan_to_num((img - np.float32(self.lo)) / np.float32(step), nan=0.0)
+        return np.clip(np.rint(codes), 0, self.n_bins - 1).astype(np.uint16)
+
+    # Valeurs correspondant à des classes (éventuellement fractionnaires, pour le centre d'une classe regroupée)
+    def values(self, codes):
+        if self.integer:
+            return np.asarray(codes, dtype=float)
+        return self.lo + np.asarray(codes, dtype=float) * (self.hi - self.lo) / (self.n_bins - 1)
+
+    # Première et dernière classes occupées par les valeurs de l'image
+    def code_range(self):
+        if self.integer:
+            return int(self.lo), int(self.hi)
+        return 0, self.n_bins - 1
+
+
+# Fonction pour construire une table de sommes cumulées avec une ligne et une colonne de zéros en tête
+def summed_area_table(values):
+    h, w, c = values.shape
+    sat = np.zeros((h + 1, w + 1, c), dtype=values.dtype)
+    np.cumsum(values, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+# Fonction pour lire la somme d'un rectangle [y0:y1, x0:x1] dans une table cumulée (4 accès)
+def rect_sum(table, x0, y0, x1, y1):
+    return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+
+class HistogramIndex:
+    # Construit l'index d'une image uint8, uint16 ou float32 en niveaux de gris (H, W) ou en couleur (H, W, C)
+    # `tables` permet de reprendre des tables déjà calculées (par exemple par un autre worker, voir IndexCache)
+    def __init__(self, img, block=BLOCK, tables=None):
+        img = np.asarray(img)
+        if img.ndim == 2:
+            img = img[:, :, np.newaxis]
+        self.img = img
+        self.block = block
+        self.height, self.width, self.channels = img.shape
+        self.scale = ValueScale(img)
+        self.n_bins = self.scale.n_bins
+        # Classes d'affichage : `bin_width` classes de valeur consécutives à partir de `bin_first` (1 et 0 pour uint8)
+        first, last = self.scale.code_range()
+        self.bin_first = first
+        self.bin_width = -(-(last - first + 1) // N_BINS)
+        self.display_bins = -(-(last - first + 1) // self.bin_width)
+        if tables is not None:
+            self.block_sum, self.block_sum_sq, self.block_cum = (
+                tables["block_sum"], tables["block_sum_sq"], tables["block_cum"]
+            )
+            return
+
+        # Histogrammes (en classes d'affichage), sommes et sommes des carrés de chaque bloc complet,
+        # calculés ligne de blocs par ligne de blocs : seule une ligne de blocs est convertie à la fois
+        n_by, n_bx = self.height // block, self.width // block
+        block_hist = np.zeros((n_by, n_bx, self.channels, N_BINS), dtype=np.int32)
+        block_sum = np.zeros((n_by, n_bx, self.channels), dtype=self._sum_dtype())
+        block_sum_sq = np.zeros_like(block_sum)
+        if n_bx > 0:
+            # Décalage de chaque pixel selon son bloc et son canal pour un seul np.bincount par ligne de blocs
+            col_block = np.repeat(np.arange(n_bx, dtype=np.intp), block)
+            offsets = (col_block[:, np.newaxis] * self.channels + np.arange(self.channels)) * N_BINS
+            for by in range(n_by):
+                rows = img[by * block:(by + 1) * block, :n_bx * block]
+                flat = (self.bins(rows).astype(np.intp) + offsets).ravel()
+                counts = np.bincount(flat, minlength=n_bx * self.channels * N_BINS)
+                block_hist[by] = counts.reshape(n_bx, self.channels, N_BINS)
+                values = self._values(rows).reshape(block, n_bx, block, self.channels)
+                block_sum[by] = values.sum(axis=(0, 2))
+                block_sum_sq[by] = (values * values).sum(axis=(0, 2))
+
+        # Tables cumulées sur la grille de blocs
+        self.block_cum = summed_area_table(block_hist.reshape(n_by, n_bx, self.channels * N_BINS)).reshape(
+            n_by + 1, n_bx + 1, self.channels, N_BINS
+        )
+        self.block_sum = summed_area_table(block_sum)
+        self.block_sum_sq = summed_area_table(block_sum_sq)
+
+    # Type des sommes : entiers 64 bits (exacts) pour uint8 et uint16, flottants 64 bits sinon
+    def _sum_dtype(self):
+        return np.int64 if self.scale.integer else np.float64
+
+    # Valeurs brutes d'une fenêtre, converties pour les sommes (les NaN comptent pour 0)
+    def _values(self, window):
+        return window.astype(np.int64) if self.scale.integer else np.nan_to_num(window.astype(np.float64))
+
+    # Blocs entièrement contenus dans le rectangle (bornes en blocs) et bandes de bordure à recompter :
+    # bandes haute et basse sur toute la largeur, bandes gauche et droite entre les deux
+    # Sans bloc entier, la bordure est le rectangle lui-même
+    def _split(self, x0, y0, x1, y1):
+        b = self.block
+        bx0, bx1 = -(-x0 // b), x1 // b
+        by0, by1 = -(-y0 // b), y1 // b
+        if bx0 >= bx1 or by0 >= by1:
+            return None, [self.img[y0:y1, x0:x1]]
+        return (bx0, by0, bx1, by1), [
+            self.img[y0:by0 * b, x0:x1],
+            self.img[by1 * b:y1, x0:x1],
+            self.img[by0 * b:by1 * b, x0:bx0 * b],
+            self.img[by0 * b:by1 * b, bx1 * b:x1],
+        ]
+
+    # Ordonne et borne les coordonnées d'un rectangle (les coordonnées des formes Plotly sont des flottants)
+    def clip_rect(self, x0, y0, x1, y1):
+        x0, x1 = sorted((int(x0), int(x1)))
+        y0, y1 = sorted((int(y0), int(y1)))
+        x0, x1 = min(max(x0, 0), self.width), min(max(x1, 0), self.width)
+        y0, y1 = min(max(y0, 0), self.height), min(max(y1, 0), self.height)
+        return x0, y0, x1, y1
+
+    # Classes d'affichage (uint8) des pixels d'une fenêtre de l'image
+    def bins(self, window):
+        if self.n_bins == N_BINS:
+            return window
+        codes = self.scale.codes(window).astype(np.int32)
+        return ((codes - self.bin_first) // self.bin_width).astype(np.uint8)
+
+    # Histogramme (C, 256) du rectangle [y0:y1, x0:x1], en classes d'affichage (les valeurs pour une image uint8)
+    def histogram(self, x0, y0, x1, y1):
+        blocks, borders = self._split(*self.clip_rect(x0, y0, x1, y1))
+        counts = np.zeros((self.channels, N_BINS), dtype=np.int64)
+        if blocks is not None:
+            counts += rect_sum(self.block_cum, *blocks)
+        for window in borders:
+            if window.size:
+                counts += count_values(self.bins(window))
+        return counts
+
+    # Nombre de pixels, moyenne et écart type par canal du rectangle [y0:y1, x0:x1]
+    def stats(self, x0, y0, x1, y1):
+        x0, y0, x1, y1 = self.clip_rect(x0, y0, x1, y1)
+        n = (x1 - x0) * (y1 - y0)
+        if n == 0:
+            nan = np.full(self.channels, np.nan)
+            return 0, nan, nan
+        blocks, borders = self._split(x0, y0, x1, y1)
+        total = np.zeros(self.channels, dtype=self._sum_dtype())
+        total_sq = np.zeros_like(total)
+        if blocks is not None:
+            total += rect_sum(self.block_sum, *blocks)
+            total_sq += rect_sum(self.block_sum_sq, *blocks)
+        for window in borders:
+            if window.size:
+                values = self._values(window)
+                total += values.sum(axis=(0, 1))
+                total_sq += (values * values).sum(axis=(0, 1))
+        mean = total / n
+        std = np.sqrt(np.maximum(total_sq / n - mean * mean, 0))
+        return n, mean, std
+
+    # Histogramme (C, 256) des pixels d'un masque local (forme non rectangulaire : cercle, chemin fermé)
+    # posé sur la fenêtre (r0, c0, r1, c1) ; seuls les pixels de la fenêtre sont lus
+    def mask_histogram(self, window, mask):
+        r0, c0, r1, c1 = window
+        return count_values(self.bins(self.img[r0:r1, c0:c1][mask]))
+
+    # Nombre de pixels, moyenne et écart type par canal des pixels d'un masque local posé sur une fenêtre
+    def mask_stats(self, window, mask):
+        r0, c0, r1, c1 = window
+        values = self._values(self.img[r0:r1, c0:c1][mask])
+        n = len(values)
+        if n == 0:
+            nan = np.full(self.channels, np.nan)
+            return 0, nan, nan
+        mean = values.sum(axis=0) / n
+        std = np.sqrt(np.maximum((values * values).sum(axis=0) / n - mean * mean, 0))
+        return n, mean, std
+
+    # Histogramme prêt à afficher : renvoie (valeurs au centre des classes, comptes (C, n)) à partir des comptes
+    # de `histogram` ; les images uint8 gardent leurs 256 classes
+    def display_histogram(self, counts):
+        if self.n_bins == N_BINS:
+            return np.arange(N_BINS), counts
+        starts = self.bin_first + np.arange(self.display_bins) * self.bin_width
+        return self.scale.values(starts + (self.bin_width - 1) / 2), counts[:, :self.display_bins]
+
+    # Tables de l'index, pour les enregistrer et les reprendre sans recalcul
+    def tables(self):
+        return {"block_sum": self.block_sum, "block_sum_sq": self.block_sum_sq, "block_cum": self.block_cum}
+
+
+class IndexCache:
+    # Garde les index des dernières versions d'image, un index étant construit une seule fois par version
+    # Avec un stockage partagé (`store`, voir shared_store.py), les tables sont écrites une fois sur disque
+    # et reprises en mémoire mappée par les autres workers.
+    def __init__(self, max_entries=4, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Construit l'index de `img`, ou le reprend du stockage partagé s'il y a déjà été écrit
+    def _build(self, key, img):
+        if self.store is None:
+            return HistogramIndex(img)
+        names = ("block_sum", "block_sum_sq", "block_cum")
+        tables = {name: self.store.get(f"{key}.hist.{name}") for name in names}
+        # Les tables écrites par une version précédente (sans blocs pour les images à grande dynamique) sont recalculées
+        n_blocks = (img.shape[0] // BLOCK + 1, img.shape[1] // BLOCK + 1)
+        if any(table is None for table in tables.values()) or tables["block_cum"].shape[:2] != n_blocks:
+            tables = {
+                name: self.store.put(f"{key}.hist.{name}", table)
+                for name, table in HistogramIndex(img).tables().items()
+            }
+        return HistogramIndex(img, tables=tables)
+
+    # Récupère l'index de l'image `key`, en le construisant à partir de `img` s'il n'existe pas encore
+    def get(self, key, img):
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = self._build(key, img)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
+
+
+# Cache partagé par les applications du dossier, adossé au stockage sur disque commun aux workers
+index_cache = IndexCache(store=shared_store)
@@ -0,0 +1,99 @@
+# Jeu d'images d'un dossier local, annotées l'une après l'autre
+# Chaque image est décodée dans le registre (LRU partagé, voir image_registry.py) et encodée à l'avance
+# dans le cache d'encodage (voir image_encoder.py). Pendant qu'une image est annotée, un thread
+# d'arrière-plan prépare les `prefetch` images suivantes, index d'histogrammes compris (voir histogram_index.py) :
+# passer à l'image suivante ne coûte alors ni décodage, ni encodage, ni construction d'index.
+import hashlib
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from adjustment_pipeline import window_key, window_level
+from histogram_index import ValueScale, index_cache
+from image_encoder import DEFAULT_CODEC, encoded_cache
+from image_registry import registry
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp")
+
+
+# Fonction pour lister les images d'un dossier, triées par nom
+def list_images(folder, extensions=IMAGE_EXTENSIONS):
+    return sorted(
+        entry.path for entry in os.scandir(os.path.abspath(folder))
+        if entry.is_file() and entry.name.lower().endswith(extensions)
+    )
+
+
+# Fonction pour calculer la clé d'un fichier image : chemin, taille et date de modification
+# (pas de lecture du fichier pour des milliers d'images)
+def file_signature_key(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode()
+    return "file-" + hashlib.blake2b(signature, digest_size=16).hexdigest()
+
+
+# Fonction pour calculer l'identifiant de session sous lequel sont enregistrées les annotations d'un dossier
+def dataset_session_id(folder):
+    return "dataset:" + os.path.abspath(folder)
+
+
+class ImageDataset:
+    def __init__(self, folder, prefetch=4, extensions=IMAGE_EXTENSIONS, codec=DEFAULT_CODEC):
+        self.folder = os.path.abspath(folder)
+        self.files = list_images(self.folder, extensions)
+        self.session_id = dataset_session_id(self.folder)
+        self.prefetch_count = prefetch
+        self.codec = codec
+        self._pending = {}  # Index -> préchargement en cours (Future)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1)  # Un seul thread : le préchargement ne concurrence pas les callbacks
+        # Les index préchargés ne doivent pas évincer celui de l'image affichée (ni celui de la précédente)
+        index_cache.max_entries = max(index_cache.max_entries, prefetch + 2)
+
+    def __len__(self):
+        return len(self.files)
+
+    # Clé d'une image (voir file_signature_key)
+    def key(self, index):
+        return file_signature_key(self.files[index])
+
+    # Décode l'image `index` (ou la reprend du registre), l'encode pour l'affichage et construit son index
+    # d'histogrammes ; renvoie (clé, image)
+    # Une image à grande dynamique est encodée dans sa fenêtre par défaut (toute l'étendue de ses valeurs)
+    def load(self, index):
+        key = self.key(index)
+        img = registry.get_or_create(key, lambda: np.array(Image.open(self.files[index])))
+        display_key, display = key, img
+        if img.dtype != np.uint8:
+            scale = ValueScale(img)
+            display_key = window_key(key, scale.lo, scale.hi)
+            display = registry.get_or_create(display_key, lambda: window_level(img, scale.lo, scale.hi, scale))
+        encoded_cache.get_or_encode(display_key, self.codec, display)
+        index_cache.get(key, img)
+        return key, img
+
+    # Image `index` prête à afficher : attend son préchargement s'il est en cours au lieu de la décoder une seconde fois
+    def fetch(self, index):
+        with self._lock:
+            future = self._pending.get(index)
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass  # Préchargement annulé avant d'avoir commencé
+        return self.load(index)
+
+    # Prépare en arrière-plan les images qui suivent `index` ; les préchargements sortis de la fenêtre sont annulés
+    def prefetch(self, index):
+        wanted = set(range(index + 1, min(index + 1 + self.prefetch_count, len(self.files))))
+        with self._lock:
+            for other in list(self._pending):
+                future = self._pending[other]
+                if future.done() or (other not in wanted and future.cancel()):
+                    del self._pending[other]
+            for other in sorted(wanted - self._pending.keys()):
+                self._pending[other] = self._pool.submit(self.load, other)
@@ -0,0 +1,141 @@
+# Encodage des images servi par URL au lieu d'être intégré à la figure
+# La figure ne contient plus l'image (ni liste `z`, ni URI base64) mais une image de mise en page
+# (layout.images) dont la source est une URL de la forme /images/<clé>/<codec>. Les octets encodés sont
+# mis en cache par version d'image et par codec : réafficher la même image ne coûte aucun encodage, et le
+# navigateur, qui garde l'URL en cache, ne la retélécharge pas.
+#
+# Codecs : "png" ou "png0" à "png9" (niveau de compression), "jpeg" ou "jpeg1" à "jpeg95" (qualité),
+# "webp" ou "webp1" à "webp100" (qualité).
+import io
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+from flask import Response, abort
+from PIL import Image
+
+DEFAULT_CODEC = "png"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Format PIL, type MIME et paramètre par défaut de chaque famille de codecs
+CODECS = {
+    "png": ("PNG", "image/png", 6),
+    "jpeg": ("JPEG", "image/jpeg", 85),
+    "webp": ("WEBP", "image/webp", 80),
+}
+
+
+# Fonction pour décomposer un codec ("jpeg85") en (famille, paramètre) ; lève ValueError s'il est inconnu
+def parse_codec(codec):
+    match = re.fullmatch(r"(png|jpeg|webp)(\d*)", codec)
+    if match is None:
+        raise ValueError(f"Codec inconnu : {codec!r}")
+    family, value = match.groups()
+    return family, int(value) if value else CODECS[family][2]
+
+
+# Fonction pour vérifier qu'un tableau peut être encodé avec la famille de codec `family` : uint8 (H, W) ou (H, W, C)
+# avec 1, 3 ou 4 canaux, ou uint16 (H, W) en PNG 16 bits. Les autres tableaux du stockage partagé (tables d'index, etc.)
+# ne sont pas servis.
+def is_display_image(img, family="png"):
+    if img.dtype == np.uint8:
+        return img.ndim == 2 or (img.ndim == 3 and img.shape[2] in (1, 3, 4))
+    return img.dtype == np.uint16 and img.ndim == 2 and family == "png"
+
+
+# Fonction pour encoder une image uint8 (H, W) ou (H, W, C) avec un codec
+def encode_image(img, codec=DEFAULT_CODEC):
+    family, value = parse_codec(codec)
+    img = np.asarray(img)
+    if family == "jpeg" and img.ndim == 3 and img.shape[2] == 4:
+        img = img[:, :, :3]  # Le JPEG n'a pas de canal alpha
+    buffer = io.BytesIO()
+    if family == "png":
+        Image.fromarray(img).save(buffer, format="PNG", compress_level=value)
+    else:
+        Image.fromarray(img).save(buffer, format=CODECS[family][0], quality=value)
+    return buffer.getvalue()
+
+
+class EncodedImageCache:
+    # Cache LRU des octets encodés, indexé par (clé de l'image, codec) et borné par leur taille totale
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._encoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_key, codec):
+        with self._lock:
+            data = self._encoded.get((image_key, codec))
+            if data is not None:
+                self._encoded.move_to_end((image_key, codec))
+            return data
+
+    # Récupère les octets encodés de l'image, en l'encodant à partir de `img` s'ils sont absents
+    def get_or_encode(self, image_key, codec, img):
+        data = self.get(image_key, codec)
+        if data is None:
+            data = encode_image(img, codec)
+            with self._lock:
+                if (image_key, codec) not in self._encoded:
+                    self._encoded[(image_key, codec)] = data
+                    self.nbytes += len(data)
+                while self.nbytes > self.max_bytes and len(self._encoded) > 1:
+                    _, evicted = self._encoded.popitem(last=False)
+                    self.nbytes -= len(evicted)
+        return data
+
+
+# Cache partagé par les applications du dossier
+encoded_cache = EncodedImageCache()
+
+
+# Fonction pour ajouter au serveur Flask de Dash la route qui sert les images encodées
+# `load_image(image_key)` renvoie l'image (ou None si elle est inconnue), par exemple `shared_store.get`
+# (qui ouvre le fichier sans l'ajouter au registre : une clé refusée ne prend pas la place d'une image)
+def register_image_route(server, load_image, cache=encoded_cache, prefix="/images"):
+    def serve_image(image_key, codec):
+        try:
+            family, _ = parse_codec(codec)
+        except ValueError:
+            abort(404)
+        data = cache.get(image_key, codec)
+        if data is None:
+            img = load_image(image_key)
+            if img is None or not is_display_image(img, family):
+                abort(404)
+            data = cache.get_or_encode(image_key, codec, img)
+        # La clé de l'image désigne une version qui ne change jamais : la réponse peut rester en cache
+        return Response(data, mimetype=CODECS[family][1], headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+    server.add_url_rule(prefix + "/<image_key>/<codec>", "serve_image", serve_image)
+
+
+# Fonction pour construire l'URL d'une image encodée
+def image_url(image_key, codec=DEFAULT_CODEC, prefix="/images"):
+    return f"{prefix}/{image_key}/{codec}"
+
+
+# Fonction pour créer une figure qui affiche l'image par URL, avec les mêmes axes que px.imshow (centre des pixels aux entiers)
+def image_figure(image_key, img_shape, codec=DEFAULT_CODEC, prefix="/images"):
+    height, width = img_shape[:2]
+    fig = go.Figure(
+        # Trace invisible aux coins de l'image pour que Plotly crée les axes
+        go.Scatter(x=[-0.5, width - 0.5], y=[-0.5, height - 0.5], mode="markers",
+                   marker_opacity=0, hoverinfo="skip", showlegend=False)
+    )
+    fig.update_layout(
+        images=[dict(
+            source=image_url(image_key, codec, prefix),
+            xref="x", yref="y",
+            x=-0.5, y=-0.5, sizex=width, sizey=height,
+            xanchor="left", yanchor="top",
+            sizing="stretch", layer="below",
+        )],
+        xaxis=dict(range=[-0.5, width - 0.5], showgrid=False, zeroline=False, constrain="domain"),
+        yaxis=dict(range=[height - 0.5, -0.5], showgrid=False, zeroline=False, scaleanchor="x"),
+    )
+    return fig
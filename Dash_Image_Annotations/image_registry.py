@@ -0,0 +1,113 @@
+# Registre d'images côté serveur
+# Les tableaux décodés restent dans le processus Dash : le navigateur ne reçoit qu'une clé
+# courte (dans un dcc.Store) au lieu de l'image entière sérialisée en JSON.
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from shared_store import shared_store
+
+# Taille maximale par défaut du registre (en octets)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Fonction pour ramener un tableau décodé à l'un des types gérés : uint8, uint16 (images 16 bits) ou float32
+# Les entiers positifs qui tiennent sur 16 bits (PNG 16 bits lus en int32 par PIL, par exemple) deviennent uint16,
+# les autres types numériques float32
+def supported_array(array):
+    array = np.asarray(array)
+    if array.dtype == np.bool_:
+        return np.ascontiguousarray(array, dtype=np.uint8)
+    if array.dtype in (np.uint8, np.uint16, np.float32):
+        return np.ascontiguousarray(array)
+    if array.dtype.kind in "ui" and (array.size == 0 or (array.min() >= 0 and array.max() <= 65535)):
+        return np.ascontiguousarray(array, dtype=np.uint16)
+    return np.ascontiguousarray(array, dtype=np.float32)
+
+
+# Fonction pour calculer l'empreinte du contenu d'un fichier, lu par blocs sans le charger en entier
+def file_key(path, block_size=1024 ** 2):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Fonction pour construire la clé d'une version traitée d'une image : empreinte source + paramètres
+def make_key(source_key, **params):
+    if not params:
+        return source_key
+    params_str = repr(sorted(params.items())).encode()
+    return source_key + ":" + hashlib.blake2b(params_str, digest_size=8).hexdigest()
+
+
+class ImageRegistry:
+    # Cache LRU d'images uint8, uint16 ou float32 (voir supported_array), borné par la taille totale des tampons
+    # Avec un stockage partagé (`backing`, voir shared_store.py), les images sont écrites une fois sur disque
+    # et conservées en mémoire mappée : les autres workers les retrouvent sans les recalculer.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, backing=None):
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self.nbytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+        with self._lock:
+            return len(self._images)
+
+    # Récupère une image (ou None si elle est inconnue) et la marque comme récemment utilisée
+    def get(self, key):
+        with self._lock:
+            array = self._images.get(key)
+            if array is not None:
+                self._images.move_to_end(key)
+        if array is not None:
+            if self.backing is not None:
+                self.backing.touch(key)  # L'éviction du stockage partagé suit l'usage, y compris en mémoire
+            return array
+        if self.backing is not None:
+            # Image évincée ou calculée par un autre worker : ouverture sans copie depuis le stockage partagé
+            array = self.backing.get(key)
+            if array is not None:
+                self._insert(key, array)
+        return array
+
+    # Enregistre une image sous une clé et évince les plus anciennes si la taille maximale est dépassée
+    def put(self, key, array):
+        array = supported_array(array)
+        if self.backing is not None:
+            array = self.backing.put(key, array)  # La copie privée est remplacée par la projection du fichier
+        array.flags.writeable = False  # Les tampons sont partagés entre callbacks : lecture seule
+        self._insert(key, array)
+        return array
+
+    def _insert(self, key, array):
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._images[key] = array
+            self.nbytes += array.nbytes
+            # L'image qui vient d'être ajoutée n'est jamais évincée, même si elle dépasse la limite à elle seule
+            while self.nbytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    # Récupère une image ou la calcule avec `factory` si elle est absente (le calcul se fait hors du verrou)
+    def get_or_create(self, key, factory):
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, factory())
+        return array
+
+
+# Registre partagé par les applications du dossier, adossé au stockage sur disque commun aux workers
+registry = ImageRegistry(backing=shared_store)
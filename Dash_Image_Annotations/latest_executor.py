@@ -0,0 +1,79 @@
+# Exécution « la plus récente l'emporte » des calculs lourds des callbacks
+# Un glissement du curseur ou le redimensionnement d'une forme déclenche une rafale de callbacks. Chaque requête
+# reçoit un numéro de séquence par (session, canal) ; le calcul part dans un pool de processus, au plus un à la
+# fois par (session, canal). Les requêtes arrivées pendant ce calcul attendent sa fin, puis seule la plus récente
+# lance le sien : les autres sont abandonnées sans rien calculer. L'attente d'une requête est donc bornée par
+# environ deux calculs, quelle que soit la longueur de la rafale.
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from dash.exceptions import PreventUpdate
+
+
+# Exception levée pour une requête dépassée par une plus récente : Dash l'interprète comme « pas de mise à jour »
+class Superseded(PreventUpdate):
+    pass
+
+
+class LatestWinsExecutor:
+    # Le pool de processus n'est créé qu'au premier calcul (les workers Dash qui n'en lancent pas n'en ont pas)
+    # Les processus partent d'un serveur « forkserver » et non d'un fork du serveur Dash : un fork au milieu des
+    # threads de Flask, de décodage et de préchargement pourrait copier un verrou pris (registre, caches) et bloquer
+    # le calcul, et donc son canal, pour toujours
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._pool = None
+        self._latest = {}  # (session, canal) -> numéro de la requête la plus récente
+        self._running = {}  # (session, canal) -> calcul en cours (Future)
+        self._lock = threading.Lock()
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("forkserver")
+                )
+            return self._pool
+
+    # Enregistre une nouvelle requête et renvoie son numéro de séquence
+    def begin(self, session_id, channel):
+        key = (session_id, channel)
+        with self._lock:
+            seq = self._latest[key] = self._latest.get(key, 0) + 1
+        return seq
+
+    # Indique si la requête `seq` est toujours la plus récente de son canal
+    def is_latest(self, session_id, channel, seq):
+        with self._lock:
+            return self._latest.get((session_id, channel)) == seq
+
+    # Exécute `fn(*args)` dans le pool pour la requête la plus récente du canal ; lève Superseded sinon
+    # `fn` et ses arguments doivent être sérialisables : les images transitent par le stockage partagé, pas par le pool
+    def run(self, session_id, channel, fn, *args):
+        key = (session_id, channel)
+        seq = self.begin(session_id, channel)
+        pool = self.pool()
+        while True:
+            with self._lock:
+                if self._latest.get(key) != seq:
+                    raise Superseded()  # Une requête plus récente est arrivée avant le début du calcul
+                current = self._running.get(key)
+                if current is None or current.done():
+                    future = self._running[key] = pool.submit(fn, *args)
+                    break
+            wait([current])  # Le calcul en cours n'est pas interrompu : on attend sa fin
+
+        try:
+            result = future.result()
+        finally:
+            with self._lock:
+                if self._running.get(key) is future:
+                    del self._running[key]
+        if not self.is_latest(session_id, channel, seq):
+            raise Superseded()  # Résultat déjà périmé : il n'est pas renvoyé au navigateur
+        return result
+
+
+# Exécuteur partagé par les applications du dossier
+executor = LatestWinsExecutor()
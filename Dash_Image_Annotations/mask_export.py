@@ -0,0 +1,138 @@
+# Export des annotations en masques : image d'étiquettes uint16 et masques RLE au format COCO
+# Chaque forme est rastérisée dans sa seule fenêtre englobante (voir shape_statistics.shape_local_mask) ;
+# le codage par plages (RLE, ordre colonne par colonne comme dans COCO) est calculé directement depuis
+# cette fenêtre par détection vectorisée des transitions, sans masque pleine image. Les images sont
+# traitées l'une après l'autre et les annotations écrites au fil de l'eau : la mémoire et le temps
+# dépendent de la surface annotée, pas du nombre d'images.
+#
+# Exemple : python mask_export.py images/ --db annotations.db -o coco.json --labels-dir labels/
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from batch_roi_stats import load_shapes
+from image_dataset import list_images
+from shape_statistics import shape_local_mask
+
+DEFAULT_CATEGORY = "roi"
+
+
+# Fonction pour coder un masque local (fenêtre (r0, c0, r1, c1) d'une image de hauteur `height`) en plages COCO
+# Les comptes alternent zéros et uns en parcourant l'image colonne par colonne, en commençant par des zéros
+def local_mask_rle(window, mask, img_shape):
+    height, width = img_shape[:2]
+    r0, c0, r1, c1 = window
+    # Une ligne de False au-dessus et au-dessous de chaque colonne : chaque plage de 1 a un début et une fin dans sa colonne
+    padded = np.zeros((mask.shape[0] + 2, mask.shape[1]), dtype=np.int8)
+    padded[1:-1] = mask
+    cols, rows = np.nonzero(np.diff(padded, axis=0).T)  # Transitions, triées par colonne puis par ligne
+    boundaries = (cols + c0) * height + (rows.astype(np.int64) + r0)
+    # Les plages coupées par le bas d'une colonne et reprises en haut de la suivante ne forment qu'une plage
+    if len(boundaries):
+        ends, next_starts = boundaries[1:-1:2], boundaries[2::2]
+        joined = np.nonzero(ends == next_starts)[0]
+        boundaries = np.delete(boundaries, np.concatenate([2 * joined + 1, 2 * joined + 2]))
+    counts = np.diff(np.concatenate([[0], boundaries, [height * width]]))
+    if len(counts) > 1 and counts[-1] == 0:
+        counts = counts[:-1]  # Masque allant jusqu'au dernier pixel : pas de plage de zéros finale vide
+    return {"size": [height, width], "counts": counts.tolist()}
+
+
+# Fonction pour rastériser chaque forme dans sa fenêtre : liste de (fenêtre, masque local), None pour les formes sans surface
+def shape_masks(shapes, img_shape):
+    return [shape_local_mask(shape, img_shape) for shape in shapes]
+
+
+# Fonction pour peindre les masques des formes dans une image d'étiquettes uint16 (0 = fond, i + 1 = forme i)
+def label_image(entries, img_shape):
+    labels = np.zeros(img_shape[:2], dtype=np.uint16)
+    for index, entry in enumerate(entries):
+        if entry is not None:
+            (r0, c0, r1, c1), mask = entry
+            labels[r0:r1, c0:c1][mask] = index + 1  # En cas de chevauchement, la dernière forme dessinée l'emporte
+    return labels
+
+
+# Fonction pour créer les annotations COCO des formes d'une image, une par forme ayant une surface
+def coco_annotations(shapes, entries, img_shape, image_id, first_id, categories):
+    annotations = []
+    for shape, entry in zip(shapes, entries):
+        if entry is None:
+            continue
+        (r0, c0, r1, c1), mask = entry
+        area = int(mask.sum())
+        if area == 0:
+            continue
+        rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+        name = (shape.get("label") or {}).get("text") or DEFAULT_CATEGORY
+        annotations.append({
+            "id": first_id + len(annotations),
+            "image_id": image_id,
+            "category_id": categories.setdefault(name, len(categories) + 1),
+            "segmentation": local_mask_rle((r0, c0, r1, c1), mask, img_shape),
+            "area": area,
+            "bbox": [int(c0 + cols[0]), int(r0 + rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)],
+            "iscrowd": 0,
+        })
+    return annotations
+
+
+# Fonction pour créer le document COCO d'une seule image (par exemple pour l'export depuis l'interface)
+def coco_document(shapes, img_shape, file_name="image.png"):
+    entries = shape_masks(shapes, img_shape)
+    categories = {}
+    annotations = coco_annotations(shapes, entries, img_shape, 1, 1, categories)
+    return {
+        "images": [{"id": 1, "file_name": file_name, "height": img_shape[0], "width": img_shape[1]}],
+        "annotations": annotations,
+        "categories": [{"id": i, "name": name} for name, i in categories.items()],
+    }
+
+
+# Fonction pour exporter toutes les images annotées d'un dossier : annotations COCO écrites au fil de l'eau
+# dans `output` et, si `labels_dir` est donné, une image d'étiquettes PNG 16 bits par image
+def export_folder(folder, output, db_path=None, labels_dir=None):
+    if labels_dir is not None:
+        os.makedirs(labels_dir, exist_ok=True)
+    images, categories = [], {}
+    n_annotations = 0
+    with open(output, "w") as f:
+        f.write('{"annotations": [')
+        for path in list_images(folder):
+            shapes = load_shapes(path, db_path)
+            if not shapes:
+                continue
+            with Image.open(path) as img:  # Seul l'en-tête est lu : la taille suffit
+                width, height = img.size
+            entries = shape_masks(shapes, (height, width))
+            image_id = len(images) + 1
+            images.append({"id": image_id, "file_name": os.path.basename(path), "height": height, "width": width})
+            for annotation in coco_annotations(shapes, entries, (height, width), image_id, n_annotations + 1, categories):
+                f.write(("," if n_annotations else "") + "\n" + json.dumps(annotation))
+                n_annotations += 1
+            if labels_dir is not None:
+                name = os.path.splitext(os.path.basename(path))[0] + "_labels.png"
+                Image.fromarray(label_image(entries, (height, width))).save(os.path.join(labels_dir, name))
+        f.write('\n], "images": ' + json.dumps(images))
+        f.write(', "categories": ' + json.dumps([{"id": i, "name": name} for name, i in categories.items()]) + "}\n")
+    return len(images), n_annotations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export annotated shapes as COCO RLE masks and uint16 label images")
+    parser.add_argument("folder", help="folder of images")
+    parser.add_argument("--db", help="annotation database of the tool (dataset mode); default: <image>.json files")
+    parser.add_argument("-o", "--output", default="coco.json", help="COCO annotation file")
+    parser.add_argument("--labels-dir", help="folder for the 16-bit label images (not written if omitted)")
+    args = parser.parse_args(argv)
+
+    n_images, n_annotations = export_folder(args.folder, args.output, args.db, args.labels_dir)
+    print(f"{n_annotations} masks from {n_images} images written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Analyse de `relayoutData` en événements typés
+# Plotly envoie soit la liste complète des formes (`shapes`) après un dessin ou un effacement,
+# soit des clés partielles comme `shapes[2].x0` ou `shapes[0].path` après une modification,
+# soit des clés d'axes (`xaxis.range[0]`, `yaxis.autorange`, ...) après un zoom ou un déplacement.
+# Toutes les clés sont lues en un seul passage et regroupées par forme.
+import re
+from collections import namedtuple
+
+# Événements produits par parse_relayout
+ShapeAdded = namedtuple("ShapeAdded", ["index", "shape"])
+ShapeChanged = namedtuple("ShapeChanged", ["index", "changes"])
+ShapeErased = namedtuple("ShapeErased", ["index"])
+ShapesReplaced = namedtuple("ShapesReplaced", ["shapes"])
+ViewportChanged = namedtuple("ViewportChanged", ["ranges"])  # {"xaxis": (min, max), ...}
+Autorange = namedtuple("Autorange", ["axes"])
+
+SHAPE_EVENTS = (ShapeAdded, ShapeChanged, ShapeErased, ShapesReplaced)
+
+SHAPE_KEY = re.compile(r"^shapes\[(\d+)\]\.(.+)$")
+AXIS_KEY = re.compile(r"^([xy]axis\d*)\.(range|autorange)(?:\[(0|1)\])?$")
+
+
+# Fonction pour convertir `relayoutData` en liste d'événements
+# - shape_count : nombre de formes connues avant cet événement
+# - previous_shapes : liste des formes connues (ou fonction qui la renvoie), utilisée uniquement
+#   pour retrouver la forme effacée lorsque la liste complète raccourcit
+def parse_relayout(relayout_data, shape_count=0, previous_shapes=None):
+    if not relayout_data:
+        return []
+
+    events = []
+    changes = {}
+    ranges = {}
+    autorange = []
+    for key, value in relayout_data.items():
+        if key == "shapes":
+            events.extend(_diff_shapes(value, shape_count, previous_shapes))
+            continue
+        match = SHAPE_KEY.match(key)
+        if match:
+            changes.setdefault(int(match.group(1)), {})[match.group(2)] = value
+            continue
+        match = AXIS_KEY.match(key)
+        if match:
+            axis, attribute, bound = match.groups()
+            if attribute == "autorange":
+                autorange.append(axis)
+            elif bound is None:
+                ranges[axis] = tuple(value)
+            else:
+                current = list(ranges.get(axis, (None, None)))
+                current[int(bound)] = value
+                ranges[axis] = tuple(current)
+        # Les autres clés (dragmode, autosize, ...) ne concernent ni les formes ni la vue
+
+    events.extend(ShapeChanged(index, fields) for index, fields in sorted(changes.items()))
+    if ranges:
+        events.append(ViewportChanged(ranges))
+    if autorange:
+        events.append(Autorange(tuple(autorange)))
+    return events
+
+
+# Fonction pour déduire l'ajout ou l'effacement d'une forme à partir de la liste complète
+def _diff_shapes(shapes, shape_count, previous_shapes):
+    if len(shapes) == shape_count + 1:
+        # Une forme dessinée est toujours ajoutée en fin de liste
+        return [ShapeAdded(shape_count, shapes[-1])]
+    if len(shapes) == shape_count - 1 and previous_shapes is not None:
+        if callable(previous_shapes):
+            previous_shapes = previous_shapes()
+        # La forme effacée est la première position où les deux listes diffèrent
+        for index, shape in enumerate(shapes):
+            if shape != previous_shapes[index]:
+                return [ShapeErased(index)]
+        return [ShapeErased(len(shapes))]
+    # Listes désynchronisées (par exemple modifiées depuis un autre onglet) : la liste reçue est signalée telle quelle
+    return [ShapesReplaced(shapes)]
+
+
+# Fonction pour savoir si les événements ne concernent que la vue (zoom, déplacement, autorange)
+def is_viewport_only(events):
+    return not any(isinstance(event, SHAPE_EVENTS) for event in events)
@@ -0,0 +1,76 @@
+# Rastérisation des chemins SVG (formes `path` de Plotly) limitée à leur rectangle englobant
+# Un petit lasso ne coûte plus une allocation et un remplissage de trous sur toute l'image : le masque
+# est calculé dans la fenêtre englobante et renvoyé sous forme compacte (fenêtre, masque local).
+# Les résultats sont mis en cache selon l'empreinte du chemin.
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import ndimage
+from skimage import draw
+
+
+# Fonction pour convertir le chemin SVG en tableau numpy de coordonnées, chaque ligne étant un point (ligne, colonne)
+def path_to_indices(path):
+    indices_str = [
+        el.replace("M", "").replace("Z", "").split(",") for el in path.split("L")
+    ]
+    return np.rint(np.array(indices_str, dtype=float)).astype(int)
+
+
+# Fonction pour rastériser un chemin fermé dans son rectangle englobant
+# Renvoie la fenêtre (r0, c0, r1, c1), bornée à l'image de taille `shape`, et le masque booléen de cette fenêtre
+def path_to_local_mask(path, shape):
+    cols, rows = path_to_indices(path).T
+    r0, r1 = max(rows.min(), 0), min(rows.max() + 1, shape[0])
+    c0, c1 = max(cols.min(), 0), min(cols.max() + 1, shape[1])
+    if r0 >= r1 or c0 >= c1:
+        return (0, 0, 0, 0), np.zeros((0, 0), dtype=bool)
+    local_shape = (r1 - r0, c1 - c0)
+    rr, cc = draw.polygon(rows - r0, cols - c0, shape=local_shape)
+    mask = np.zeros(local_shape, dtype=bool)
+    mask[rr, cc] = True
+    mask = ndimage.binary_fill_holes(mask)
+    return (r0, c0, r1, c1), mask
+
+
+# Fonction pour convertir le chemin SVG en un masque binaire de toute l'image (pour les traitements qui en ont besoin)
+def path_to_mask(path, shape):
+    (r0, c0, r1, c1), local_mask = mask_cache.get(path, shape)
+    mask = np.zeros(shape, dtype=bool)
+    mask[r0:r1, c0:c1] = local_mask
+    return mask
+
+
+class MaskCache:
+    # Cache LRU des masques compacts, indexé par l'empreinte du chemin et la taille de l'image
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, shape):
+        key = (hashlib.blake2b(path.encode(), digest_size=16).digest(), tuple(shape[:2]))
+        with self._lock:
+            entry = self._masks.get(key)
+            if entry is not None:
+                self._masks.move_to_end(key)
+                return entry
+        entry = path_to_local_mask(path, shape[:2])
+        entry[1].flags.writeable = False  # Masque partagé entre appels : lecture seule
+        with self._lock:
+            self._masks[key] = entry
+            while len(self._masks) > self.max_entries:
+                self._masks.popitem(last=False)
+        return entry
+
+
+# Cache partagé par les applications du dossier
+mask_cache = MaskCache()
+
+
+# Fonction pour extraire les valeurs des pixels enfermés par le chemin, en ne lisant que sa fenêtre englobante
+def masked_values(img, path):
+    (r0, c0, r1, c1), local_mask = mask_cache.get(path, img.shape)
+    return img[r0:r1, c0:c1][local_mask]
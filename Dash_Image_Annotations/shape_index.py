@@ -0,0 +1,245 @@
+# Stockage compact des formes d'une image, avec index spatial par grille
+# Les rectangles englobants de toutes les formes sont rangés dans un tableau structuré NumPy et les sommets
+# des chemins dans un seul tampon (sommets + positions de début). Une grille de cellules de `cell` pixels
+# (stockage compressé : clés de cellules triées + tranches d'identifiants) donne les formes candidates d'un
+# point ou d'un rectangle ; les tests exacts, les aires et les IoU sont ensuite calculés en une fois sur
+# les candidats. Les formes ajoutées ou modifiées depuis la construction de la grille sont testées à part,
+# la grille n'étant reconstruite qu'après de nombreuses modifications ou une suppression.
+import re
+
+import numpy as np
+
+# Types de formes ; les chemins ouverts et les lignes n'ont pas de surface
+RECT, CIRCLE, PATH, LINE = 0, 1, 2, 3
+KINDS = {"rect": RECT, "circle": CIRCLE, "path": PATH, "line": LINE}
+
+BOUNDS_DTYPE = np.dtype([("kind", "u1"), ("x0", "f8"), ("y0", "f8"), ("x1", "f8"), ("y1", "f8")])
+
+GRID_KEY_STRIDE = 1 << 32  # Clé d'une cellule : ligne * GRID_KEY_STRIDE + colonne
+MAX_CELLS_PER_SHAPE = 64  # Au-delà, la forme est rangée dans la liste des grandes formes, toujours candidates
+MAX_PENDING = 1024  # Nombre de formes modifiées depuis la construction de la grille avant sa reconstruction
+
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+# Fonction pour lire les sommets (x, y) d'un chemin SVG Plotly (M x,y L x,y ... Z) en coordonnées flottantes
+def path_vertices(path):
+    return np.array(NUMBER.findall(path), dtype=float).reshape(-1, 2)
+
+
+class ShapeArray:
+    def __init__(self, shapes=(), cell=64):
+        self.cell = cell
+        self.set_shapes(shapes)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    # Rectangle englobant et sommets d'une forme Plotly
+    @staticmethod
+    def _encode(shape):
+        kind = shape.get("type", "path" if "path" in shape else "rect")
+        if kind == "path":
+            vertices = path_vertices(shape.get("path", ""))
+            closed = shape.get("path", "").rstrip().endswith("Z") and len(vertices) >= 3
+            if len(vertices) == 0:
+                return (LINE, 0.0, 0.0, 0.0, 0.0), vertices
+            (x0, y0), (x1, y1) = vertices.min(axis=0), vertices.max(axis=0)
+            return (PATH if closed else LINE, x0, y0, x1, y1), vertices
+        x0, x1 = sorted((float(shape["x0"]), float(shape["x1"])))
+        y0, y1 = sorted((float(shape["y0"]), float(shape["y1"])))
+        return (KINDS.get(kind, LINE), x0, y0, x1, y1), np.empty((0, 2))
+
+    # Remplace toutes les formes
+    def set_shapes(self, shapes):
+        self.shapes = list(shapes)
+        encoded = [self._encode(shape) for shape in self.shapes]
+        self.bounds = np.array([bounds for bounds, _ in encoded], dtype=BOUNDS_DTYPE)
+        self._set_vertices([vertices for _, vertices in encoded])
+        self._grid = None
+
+    # Tampon des sommets de tous les chemins : sommets de la forme i dans vertices[offsets[i]:offsets[i + 1]]
+    def _set_vertices(self, vertex_lists):
+        counts = np.array([len(v) for v in vertex_lists], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.vertices = np.concatenate(vertex_lists) if vertex_lists else np.empty((0, 2))
+
+    # Remplace les sommets de la forme `index` (None : supprime la forme du tampon) sans toucher aux autres formes
+    def _splice_vertices(self, index, vertices=None):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        new = vertices if vertices is not None else np.empty((0, 2))
+        self.vertices = np.concatenate([self.vertices[:start], new, self.vertices[end:]])
+        offsets = self.offsets.copy()
+        offsets[index + 1:] += len(new) - (end - start)
+        self.offsets = offsets if vertices is not None else np.delete(offsets, index + 1)
+
+    # Ajoute une forme à la fin ; elle est testée à part jusqu'à la prochaine construction de la grille
+    def append(self, shape):
+        bounds, vertices = self._encode(shape)
+        self.shapes.append(shape)
+        self.bounds = np.append(self.bounds, np.array([bounds], dtype=BOUNDS_DTYPE))
+        self.vertices = np.concatenate([self.vertices, vertices])
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(vertices))
+        self._mark_pending(len(self.shapes) - 1)
+
+    # Remplace la forme `index` ; ses anciennes cellules restent dans la grille mais ne passent plus les tests exacts
+    def update(self, index, shape):
+        bounds, vertices = self._encode(shape)
+        self.shapes[index] = shape
+        self.bounds[index] = bounds
+        self._splice_vertices(index, vertices)
+        self._mark_pending(index)
+
+    # Supprime la forme `index` ; les identifiants suivants reculent d'une position, la grille est reconstruite
+    def remove(self, index):
+        del self.shapes[index]
+        self.bounds = np.delete(self.bounds, index)
+        self._splice_vertices(index)
+        self._grid = None
+
+    def _mark_pending(self, index):
+        if self._grid is not None:
+            self._grid["pending"].add(index)
+            if len(self._grid["pending"]) > MAX_PENDING:
+                self._grid = None
+
+    # Cellules (colonne, ligne) couvertes par des rectangles
+    def _cell_ranges(self, x0, y0, x1, y1):
+        return (np.floor(x0 / self.cell).astype(np.int64), np.floor(y0 / self.cell).astype(np.int64),
+                np.floor(x1 / self.cell).astype(np.int64), np.floor(y1 / self.cell).astype(np.int64))
+
+    # Construit la grille : pour chaque cellule, les identifiants des formes qui la recoupent
+    def _build_grid(self):
+        b = self.bounds
+        cx0, cy0, cx1, cy1 = self._cell_ranges(b["x0"], b["y0"], b["x1"], b["y1"])
+        nx, ny = cx1 - cx0 + 1, cy1 - cy0 + 1
+        n_cells = nx * ny
+        large = n_cells > MAX_CELLS_PER_SHAPE
+        ids = np.nonzero(~large)[0]
+        n_cells, nx = n_cells[ids], nx[ids]
+        # Une entrée par (forme, cellule) : rang de la cellule dans le rectangle de la forme -> (colonne, ligne)
+        shape_ids = np.repeat(ids, n_cells)
+        rank = np.arange(n_cells.sum()) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        cols = cx0[shape_ids] + rank % np.repeat(nx, n_cells)
+        rows = cy0[shape_ids] + rank // np.repeat(nx, n_cells)
+        keys = rows * GRID_KEY_STRIDE + cols
+        order = np.argsort(keys, kind="stable")
+        keys, shape_ids = keys[order], shape_ids[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        self._grid = {
+            "keys": unique_keys,
+            "starts": np.append(starts, len(keys)),
+            "ids": shape_ids,
+            "large": np.nonzero(large)[0],
+            "pending": set(),
+        }
+        return self._grid
+
+    # Identifiants des formes dont le rectangle englobant recoupe le rectangle [x0, x1] x [y0, y1]
+    def candidates(self, x0, y0, x1, y1):
+        grid = self._grid if self._grid is not None else self._build_grid()
+        cx0, cy0, cx1, cy1 = self._cell_ranges(np.float64(x0), np.float64(y0), np.float64(x1), np.float64(y1))
+        cols, rows = np.meshgrid(np.arange(cx0, cx1 + 1), np.arange(cy0, cy1 + 1))
+        keys = (rows * GRID_KEY_STRIDE + cols).ravel()
+        slots = np.searchsorted(grid["keys"], keys)
+        slots = slots[slots < len(grid["keys"])]
+        slots = slots[np.isin(grid["keys"][slots], keys)]
+        parts = [grid["ids"][grid["starts"][s]:grid["starts"][s + 1]] for s in slots]
+        parts += [grid["large"], np.fromiter(grid["pending"], dtype=np.int64, count=len(grid["pending"]))]
+        ids = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        b = self.bounds[ids]
+        keep = (b["x0"] <= x1) & (b["x1"] >= x0) & (b["y0"] <= y1) & (b["y1"] >= y0)
+        return ids[keep]
+
+    # Identifiants des formes qui contiennent le point (x, y), dans l'ordre de dessin
+    def hit_test(self, x, y):
+        ids = self.candidates(x, y, x, y)
+        b = self.bounds[ids]
+        hit = b["kind"] == RECT
+        circles = b["kind"] == CIRCLE
+        if circles.any():
+            c = b[circles]
+            a, r = (c["x1"] - c["x0"]) / 2, (c["y1"] - c["y0"]) / 2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                d = ((x - (c["x0"] + a)) / a) ** 2 + ((y - (c["y0"] + r)) / r) ** 2
+            hit[circles] = d <= 1
+        paths = b["kind"] == PATH
+        if paths.any():
+            hit[paths] = self._points_in_paths(ids[paths], x, y)
+        return ids[hit]
+
+    # Test point dans polygone (règle pair-impair) pour plusieurs chemins à la fois, arêtes de tous les chemins réunies
+    def _points_in_paths(self, ids, x, y):
+        starts, ends = self.offsets[ids], self.offsets[ids + 1]
+        lengths = ends - starts
+        first = np.repeat(starts, lengths)
+        index = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        p = self.vertices[first + index]
+        q = self.vertices[first + (index + 1) % np.repeat(lengths, lengths)]  # Sommet suivant, le chemin étant fermé
+        crosses = (p[:, 1] > y) != (q[:, 1] > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = p[:, 0] + (y - p[:, 1]) * (q[:, 0] - p[:, 0]) / (q[:, 1] - p[:, 1])
+        inside = crosses & (x < x_cross)
+        return np.add.reduceat(inside.astype(np.int64), np.cumsum(lengths) - lengths) % 2 == 1
+
+    # Aires des formes (toutes, ou celles de `ids`) : rectangle, ellipse inscrite, polygone (formule du lacet)
+    def areas(self, ids=None):
+        ids = np.arange(len(self.bounds)) if ids is None else np.asarray(ids)
+        b = self.bounds[ids]
+        w, h = b["x1"] - b["x0"], b["y1"] - b["y0"]
+        areas = np.where(b["kind"] == RECT, w * h, np.where(b["kind"] == CIRCLE, np.pi * w * h / 4, 0.0))
+        paths = np.nonzero(b["kind"] == PATH)[0]
+        if len(paths):
+            path_ids = ids[paths]
+            starts, lengths = self.offsets[path_ids], self.offsets[path_ids + 1] - self.offsets[path_ids]
+            first = np.repeat(starts, lengths)
+            index = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            p = self.vertices[first + index]
+            q = self.vertices[first + (index + 1) % np.repeat(lengths, lengths)]
+            cross = p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]
+            areas[paths] = np.abs(np.add.reduceat(cross, np.cumsum(lengths) - lengths)) / 2
+        return areas
+
+    # IoU des rectangles englobants d'un rectangle requête avec les formes `ids` (par défaut celles qui le recoupent)
+    def iou(self, x0, y0, x1, y1, ids=None):
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        ids = self.candidates(x0, y0, x1, y1) if ids is None else np.asarray(ids)
+        b = self.bounds[ids]
+        iw = np.clip(np.minimum(b["x1"], x1) - np.maximum(b["x0"], x0), 0, None)
+        ih = np.clip(np.minimum(b["y1"], y1) - np.maximum(b["y0"], y0), 0, None)
+        inter = iw * ih
+        union = (x1 - x0) * (y1 - y0) + (b["x1"] - b["x0"]) * (b["y1"] - b["y0"]) - inter
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return ids, np.where(union > 0, inter / union, 0.0)
+
+    # Paires (i, j), i < j, de formes du même type dont les rectangles englobants ont une IoU d'au moins `threshold`
+    # Deux formes qui se recouvrent partagent au moins une cellule : les paires candidates sont celles de chaque cellule
+    def duplicates(self, threshold=0.9):
+        grid = self._grid if self._grid is not None else self._build_grid()
+        if grid["pending"]:
+            grid = self._build_grid()  # Toutes les formes doivent être à jour dans la grille
+        sizes = np.diff(grid["starts"])
+        # Pour chaque entrée d'une cellule, paires avec les entrées suivantes de la même cellule
+        position = np.arange(len(grid["ids"])) - np.repeat(grid["starts"][:-1], sizes)
+        after = np.repeat(sizes, sizes) - position - 1
+        first = np.repeat(np.arange(len(grid["ids"])), after)
+        second = first + 1 + np.arange(after.sum()) - np.repeat(np.cumsum(after) - after, after)
+        i, j = grid["ids"][first], grid["ids"][second]
+        # Les grandes formes, hors de la grille, sont comparées à toutes les autres
+        others = np.arange(len(self.bounds))
+        i = np.concatenate([i, np.repeat(grid["large"], len(others))])
+        j = np.concatenate([j, np.tile(others, len(grid["large"]))])
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        pairs = np.unique(np.stack([i, j], axis=1)[i != j], axis=0)
+        if len(pairs) == 0:
+            return []
+        a, b = self.bounds[pairs[:, 0]], self.bounds[pairs[:, 1]]
+        iw = np.clip(np.minimum(a["x1"], b["x1"]) - np.maximum(a["x0"], b["x0"]), 0, None)
+        ih = np.clip(np.minimum(a["y1"], b["y1"]) - np.maximum(a["y0"], b["y0"]), 0, None)
+        inter = iw * ih
+        union = (a["x1"] - a["x0"]) * (a["y1"] - a["y0"]) + (b["x1"] - b["x0"]) * (b["y1"] - b["y0"]) - inter
+        with np.errstate(divide="ignore", invalid="ignore"):
+            iou = np.where(union > 0, inter / union, 0.0)
+        keep = (iou >= threshold) & (a["kind"] == b["kind"])
+        return [tuple(pair) for pair in pairs[keep].tolist()]
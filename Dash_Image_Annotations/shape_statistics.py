@@ -0,0 +1,272 @@
+# Statistiques de toutes les formes annotées en une seule passe
+# Les rectangles, cercles et chemins fermés sont rastérisés dans une image d'étiquettes (0 = fond,
+# sinon l'étiquette de la forme ; en cas de chevauchement la dernière forme dessinée l'emporte). Les
+# histogrammes de toutes les étiquettes sont ensuite obtenus par un seul np.bincount sur (étiquette, canal,
+# valeur), d'où le nombre de pixels, la moyenne et l'écart type de chaque forme. Quand une forme change,
+# seule la fenêtre qu'elle couvrait ou couvre désormais est redessinée et recomptée.
+# L'image d'étiquettes n'est jamais gardée en entier : elle est redessinée à la demande, par bandes d'au
+# plus BAND_PIXELS pixels, à partir des masques locaux des formes. La mémoire ne dépend donc que de la
+# taille des formes, pas de celle de l'image (pyramides de tuiles de plusieurs centaines de mégapixels).
+# Les étiquettes ne sont jamais renumérotées : chaque forme garde son étiquette (liste `label_ids`, de la position
+# de la forme vers son étiquette) et la suppression d'une forme ne touche que la fenêtre qu'elle couvrait.
+# Pour les images uint16 et float32, des histogrammes de 65 536 classes par forme prendraient trop de
+# mémoire : on garde à la place le nombre de pixels, la somme et la somme des carrés de chaque
+# (étiquette, canal), obtenus par np.bincount pondéré. Ces moments s'additionnent comme des
+# histogrammes, la mise à jour incrémentale reste donc la même.
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from skimage import draw
+
+from histogram_index import N_BINS
+from roi_masks import mask_cache
+from shape_index import ShapeArray
+
+# Types de formes qui délimitent une surface
+AREA_SHAPES = ("rect", "circle", "path")
+
+# Nombre maximal de pixels d'une bande de l'image d'étiquettes (et du np.bincount correspondant)
+BAND_PIXELS = 1024 * 1024
+
+# IoU minimale des rectangles englobants de deux formes du même type pour signaler un doublon
+DUPLICATE_IOU = 0.9
+
+
+# Fonction pour ordonner et borner la fenêtre (r0, c0, r1, c1) d'une forme définie par x0, y0, x1, y1
+def _box_window(shape, img_shape):
+    x0, x1 = sorted((float(shape["x0"]), float(shape["x1"])))
+    y0, y1 = sorted((float(shape["y0"]), float(shape["y1"])))
+    r0, r1 = max(int(y0), 0), min(int(np.ceil(y1)), img_shape[0])
+    c0, c1 = max(int(x0), 0), min(int(np.ceil(x1)), img_shape[1])
+    return (r0, c0, max(r1, r0), max(c1, c0)), (x0, y0, x1, y1)
+
+
+# Fonction pour rastériser une forme Plotly dans sa fenêtre : renvoie (fenêtre, masque local) ou None
+def shape_local_mask(shape, img_shape):
+    kind = shape.get("type", "path" if "path" in shape else "rect")
+    if kind == "path":
+        if not shape.get("path", "").rstrip().endswith("Z"):
+            return None  # Chemin ouvert : pas de surface
+        return mask_cache.get(shape["path"], img_shape)
+    if kind not in AREA_SHAPES:
+        return None  # Lignes : pas de surface
+    window, (x0, y0, x1, y1) = _box_window(shape, img_shape)
+    r0, c0, r1, c1 = window
+    if kind == "rect":
+        return window, np.ones((r1 - r0, c1 - c0), dtype=bool)
+    # Cercle Plotly : ellipse inscrite dans le rectangle (x0, y0, x1, y1)
+    mask = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    if x1 - x0 < 1 or y1 - y0 < 1:
+        return window, mask
+    rr, cc = draw.ellipse((y0 + y1) / 2 - r0, (x0 + x1) / 2 - c0, (y1 - y0) / 2, (x1 - x0) / 2, shape=mask.shape)
+    mask[rr, cc] = True
+    return window, mask
+
+
+class ShapeStatistics:
+    # Image d'étiquettes et histogrammes (forme, canal, valeur) d'une image uint8 (H, W) ou (H, W, C),
+    # ou moments (forme, canal, [nombre, somme, somme des carrés]) d'une image uint16 ou float32
+    # Les callbacks d'une même session peuvent s'exécuter en parallèle : une suite de modifications et la lecture
+    # des résultats se font sous `lock` (réentrant, chaque méthode le prend aussi)
+    def __init__(self, img, shapes=()):
+        self.img = img if img.ndim == 3 else img[:, :, np.newaxis]
+        self.channels = self.img.shape[2]
+        self.moments = self.img.dtype != np.uint8
+        self.n_values = 3 if self.moments else N_BINS
+        self.lock = threading.RLock()
+        self.shapes = []
+        self.masks = []  # (fenêtre, masque local) de chaque forme, ou None
+        self.label_ids = []  # Étiquette de chaque forme (ligne de `counts`)
+        self.index = ShapeArray()  # Rectangles englobants et index spatial des formes (doublons, formes sous un point)
+        self.counts = self._zeros(1)
+        self.set_shapes(shapes)
+
+    def _zeros(self, n_labels):
+        return np.zeros((n_labels, self.channels, self.n_values), dtype=np.float64 if self.moments else np.int64)
+
+    # Comptes (étiquette, canal, valeur) ou moments (étiquette, canal) d'une fenêtre, bande par bande
+    def _window_counts(self, window):
+        r0, c0, r1, c1 = window
+        counts = self._zeros(len(self.counts))
+        step = max(1, BAND_PIXELS // max(c1 - c0, 1))
+        for band_r0 in range(r0, r1, step):
+            counts += self._band_counts((band_r0, c0, min(band_r0 + step, r1), c1))
+        return counts
+
+    # Comptes d'une bande, en un seul np.bincount sur ses étiquettes redessinées
+    def _band_counts(self, window):
+        r0, c0, r1, c1 = window
+        labels = self._paint(window)[:, :, np.newaxis].astype(np.intp)
+        values = self.img[r0:r1, c0:c1]
+        n_labels = len(self.counts)
+        if self.moments:
+            flat = (labels * self.channels + np.arange(self.channels)).ravel()
+            values = np.nan_to_num(values.astype(np.float64)).ravel()
+            size = n_labels * self.channels
+            return np.stack([
+                np.bincount(flat, minlength=size),
+                np.bincount(flat, weights=values, minlength=size),
+                np.bincount(flat, weights=values * values, minlength=size),
+            ], axis=-1).reshape(n_labels, self.channels, 3)
+        flat = ((labels * self.channels + np.arange(self.channels)) * N_BINS + values).ravel()
+        return np.bincount(flat, minlength=n_labels * self.channels * N_BINS).reshape(n_labels, self.channels, N_BINS)
+
+    # Étiquettes d'une fenêtre : toutes les formes qui la recoupent, redessinées dans l'ordre de dessin
+    def _paint(self, window):
+        r0, c0, r1, c1 = window
+        labels = np.zeros((r1 - r0, c1 - c0), dtype=np.int32)
+        for label, entry in zip(self.label_ids, self.masks):
+            if entry is None:
+                continue
+            (sr0, sc0, sr1, sc1), mask = entry
+            ir0, ic0, ir1, ic1 = max(r0, sr0), max(c0, sc0), min(r1, sr1), min(c1, sc1)
+            if ir0 >= ir1 or ic0 >= ic1:
+                continue
+            local = mask[ir0 - sr0:ir1 - sr0, ic0 - sc0:ic1 - sc0]
+            labels[ir0 - r0:ir1 - r0, ic0 - c0:ic1 - c0][local] = label
+        return labels
+
+    # Recalcule la fenêtre : les comptes de l'ancien état sont retirés, ceux du nouvel état ajoutés
+    def _refresh(self, window, change):
+        r0, c0, r1, c1 = window
+        if r0 >= r1 or c0 >= c1:
+            change()
+            return
+        before = self._window_counts(window)
+        change()
+        self.counts[:len(before)] -= before
+        self.counts += self._window_counts(window)
+
+    # Remplace toutes les formes : image d'étiquettes et histogrammes recalculés en une passe (étiquettes 1 à n)
+    def set_shapes(self, shapes):
+        with self.lock:
+            self.shapes = list(shapes)
+            self.masks = [shape_local_mask(shape, self.img.shape) for shape in self.shapes]
+            self.label_ids = list(range(1, len(self.shapes) + 1))
+            self.index.set_shapes(self.shapes)
+            self.counts = self._zeros(len(self.shapes) + 1)
+            self.counts = self._window_counts((0, 0) + self.img.shape[:2])
+
+    # Ajoute une forme à la fin de la liste (dessinée au-dessus des autres), avec une nouvelle étiquette
+    def add_shape(self, shape):
+        entry = shape_local_mask(shape, self.img.shape)
+
+        def change():
+            self.shapes.append(shape)
+            self.masks.append(entry)
+            self.label_ids.append(len(self.counts))
+            self.index.append(shape)
+            self.counts = np.concatenate([self.counts, self._zeros(1)])
+
+        with self.lock:
+            self._refresh(entry[0] if entry else (0, 0, 0, 0), change)
+
+    # Remplace la forme `index` (déplacée, redimensionnée ou chemin modifié)
+    def update_shape(self, index, shape):
+        entry = shape_local_mask(shape, self.img.shape)
+
+        def change():
+            self.shapes[index] = shape
+            self.masks[index] = entry
+            self.index.update(index, shape)
+
+        with self.lock:
+            old = self.masks[index]
+            self._refresh(_union(old[0] if old else None, entry[0] if entry else None), change)
+
+    # Supprime la forme `index` : seule la fenêtre qu'elle couvrait est redessinée (les autres étiquettes ne changent pas)
+    # La ligne de son étiquette dans `counts` reste à zéro jusqu'au prochain set_shapes
+    def remove_shape(self, index):
+        def change():
+            del self.shapes[index]
+            del self.masks[index]
+            del self.label_ids[index]
+            self.index.remove(index)
+
+        with self.lock:
+            old = self.masks[index]
+            self._refresh(old[0] if old else (0, 0, 0, 0), change)
+
+    # Histogrammes (forme, canal, valeur) de toutes les formes, None pour une image à grande dynamique
+    def histograms(self):
+        with self.lock:
+            return None if self.moments else self.counts[self.label_ids]
+
+    # Positions des formes qui contiennent le point (x, y), dans l'ordre de dessin
+    def shapes_at(self, x, y):
+        with self.lock:
+            return self.index.hit_test(x, y).tolist()
+
+    # Pour chaque forme, la première forme dont elle est le doublon (None sinon), d'après l'index spatial
+    def duplicate_of(self):
+        with self.lock:
+            first = [None] * len(self.shapes)
+            for i, j in self.index.duplicates(DUPLICATE_IOU):
+                if first[j] is None or i < first[j]:
+                    first[j] = i
+            return first
+
+    # Tableau des statistiques : une ligne par forme (nombre de pixels, moyenne et écart type par canal,
+    # forme dont elle est le doublon)
+    def rows(self):
+        with self.lock:
+            counts = self.counts[self.label_ids]
+            shapes = list(self.shapes)
+            duplicates = self.duplicate_of()
+        if self.moments:
+            n = np.rint(counts[:, 0, 0]).astype(np.int64)
+            safe_n = np.maximum(n, 1)[:, np.newaxis]
+            mean = counts[:, :, 1] / safe_n
+            mean_sq = counts[:, :, 2] / safe_n
+        else:
+            values = np.arange(N_BINS, dtype=float)
+            n = counts[:, 0].sum(axis=1)
+            safe_n = np.maximum(n, 1)[:, np.newaxis]
+            mean = (counts * values).sum(axis=2) / safe_n
+            mean_sq = (counts * values ** 2).sum(axis=2) / safe_n
+        std = np.sqrt(np.maximum(mean_sq - mean ** 2, 0))
+        rows = []
+        for index, shape in enumerate(shapes):
+            row = {"shape": index, "type": shape.get("type", "path"), "pixels": int(n[index]),
+                   "duplicate_of": duplicates[index]}
+            for channel in range(self.channels):
+                row[f"mean_{channel}"] = round(float(mean[index, channel]), 2)
+                row[f"std_{channel}"] = round(float(std[index, channel]), 2)
+            rows.append(row)
+        return rows
+
+
+# Fonction pour réunir deux fenêtres (r0, c0, r1, c1), l'une ou l'autre pouvant être absente
+def _union(a, b):
+    if a is None:
+        return b or (0, 0, 0, 0)
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class StatisticsCache:
+    # Garde les moteurs de statistiques des dernières (session, version d'image) annotées
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+            return engine
+
+    def put(self, key, engine):
+        with self._lock:
+            self._engines[key] = engine
+            while len(self._engines) > self.max_entries:
+                self._engines.popitem(last=False)
+        return engine
+
+
+# Cache partagé par les applications du dossier
+stats_cache = StatisticsCache()
@@ -0,0 +1,85 @@
+# Stockage partagé des images décodées et des tableaux dérivés, sous forme de fichiers .npy sur disque local
+# Un tableau est écrit une seule fois (par le premier worker qui le calcule) puis ouvert par tous les
+# processus en mémoire mappée (np.load(mmap_mode="r")) : les pages sont partagées par le cache du système,
+# la mémoire ne grandit donc plus avec le nombre de workers et aucun worker ne redécode une image déjà décodée.
+import os
+import re
+import tempfile
+import uuid
+
+import numpy as np
+
+# Répertoire par défaut (modifiable par la variable d'environnement DASH_IMAGE_STORE)
+DEFAULT_ROOT = os.environ.get("DASH_IMAGE_STORE", os.path.join(tempfile.gettempdir(), "dash_image_store"))
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+
+
+class SharedImageStore:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    # Chemin du fichier d'une clé (les caractères non sûrs pour un nom de fichier sont remplacés)
+    def path(self, key):
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", key) + ".npy")
+
+    # Ouvre un tableau en lecture seule et sans copie, ou renvoie None s'il n'a pas encore été écrit
+    def get(self, key):
+        try:
+            array = np.load(self.path(key), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return array
+
+    # Marque un tableau comme récemment utilisé : les lectures en mémoire mappée ne changent pas la date du fichier,
+    # sur laquelle se fonde l'éviction (_trim)
+    def touch(self, key):
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass  # Supprimé entre-temps par un autre worker
+
+    # Écrit un tableau puis le renvoie ouvert en mémoire mappée
+    def put(self, key, array):
+        path = self.path(key)
+        self._trim(keep=path, incoming=array.nbytes)
+        # Écriture dans un fichier temporaire puis renommage atomique : les autres workers ne voient jamais de fichier partiel
+        tmp_path = f"{path[:-4]}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode="r")
+
+    # Récupère un tableau ou le calcule avec `factory` et l'écrit s'il n'existe pas encore
+    def get_or_create(self, key, factory):
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, factory())
+        return array
+
+    # Supprime les fichiers les moins récemment utilisés au-delà de la taille maximale
+    # (les workers qui ont déjà ouvert un fichier supprimé gardent leur projection valide)
+    def _trim(self, keep, incoming):
+        entries = []
+        for entry in os.scandir(self.root):
+            # Les fichiers temporaires en cours d'écriture par d'autres workers ne sont pas comptés
+            if entry.name.endswith(".npy") and not entry.name.endswith(".tmp.npy") and entry.path != keep:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Supprimé entre-temps par un autre worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries) + incoming
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Déjà supprimé par un autre worker
+            total -= size
+
+
+# Stockage partagé par les applications du dossier
+shared_store = SharedImageStore()
@@ -0,0 +1,165 @@
+# Pyramide multi-résolution pour afficher et annoter de très grandes images
+# Chaque niveau est l'image précédente sous-échantillonnée d'un facteur 2. La figure ne contient
+# que les tuiles du niveau adapté à la zone visible, référencées par URL (route Flask servie par
+# le serveur Dash) : le navigateur ne reçoit jamais l'image pleine résolution. Les axes de la figure
+# restent en pixels pleine résolution, les coordonnées des formes dessinées aussi.
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+from flask import Response, abort
+
+from image_encoder import encode_image, is_display_image
+
+TILE_SIZE = 256
+SCREEN_PX = 1024  # Largeur approximative du graphique à l'écran (en pixels)
+
+
+# Fonction pour sous-échantillonner une image d'un facteur 2 (moyenne de blocs 2x2, bords répliqués si dimension impaire)
+# La somme se fait sur un type deux fois plus large que celui de l'image (uint8 ou uint16), qui est conservé
+def downsample(img):
+    h, w = img.shape[:2]
+    if h % 2 or w % 2:
+        pad = [(0, h % 2), (0, w % 2)] + [(0, 0)] * (img.ndim - 2)
+        img = np.pad(img, pad, mode="edge")
+    wide = np.uint16 if img.dtype == np.uint8 else np.uint32
+    total = (
+        img[0::2, 0::2].astype(wide) + img[1::2, 0::2] + img[0::2, 1::2] + img[1::2, 1::2]
+    )
+    return ((total + 2) // 4).astype(img.dtype)
+
+
+class TilePyramid:
+    # Construit tous les niveaux de la pyramide, du plein format jusqu'à une seule tuile
+    def __init__(self, img, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.height, self.width = img.shape[:2]
+        self.levels = [img]
+        while max(self.levels[-1].shape[:2]) > tile_size:
+            self.levels.append(downsample(self.levels[-1]))
+        self._tiles = {}  # (niveau, ty, tx) -> octets PNG, encodés à la première demande
+        self._lock = threading.Lock()
+
+    # Niveau le plus grossier dont la résolution suffit pour afficher la zone visible sur `screen_px` pixels
+    def level_for(self, x_range=None, y_range=None, screen_px=SCREEN_PX):
+        x0, x1 = x_range if x_range else (0, self.width)
+        y0, y1 = y_range if y_range else (0, self.height)
+        visible = max(abs(x1 - x0), abs(y1 - y0), 1)
+        level = int(math.floor(math.log2(max(visible / screen_px, 1))))
+        return min(level, len(self.levels) - 1)
+
+    # Tuiles d'un niveau qui recoupent la zone visible, avec leur position en pixels pleine résolution
+    def tiles_in_view(self, level, x_range=None, y_range=None):
+        scale = 2 ** level
+        span = self.tile_size * scale
+        x0, x1 = sorted(x_range) if x_range else (0, self.width)
+        y0, y1 = sorted(y_range) if y_range else (0, self.height)
+        h, w = self.levels[level].shape[:2]
+        tx0, tx1 = max(int(x0 // span), 0), min(int(math.ceil(x1 / span)), math.ceil(w / self.tile_size))
+        ty0, ty1 = max(int(y0 // span), 0), min(int(math.ceil(y1 / span)), math.ceil(h / self.tile_size))
+        tiles = []
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                tile_h = min(self.tile_size, h - ty * self.tile_size)
+                tile_w = min(self.tile_size, w - tx * self.tile_size)
+                tiles.append((ty, tx, tx * span, ty * span, tile_w * scale, tile_h * scale))
+        return tiles
+
+    # Octets PNG d'une tuile (encodée une seule fois)
+    def tile_png(self, level, ty, tx):
+        key = (level, ty, tx)
+        with self._lock:
+            data = self._tiles.get(key)
+        if data is None:
+            t = self.tile_size
+            tile = self.levels[level][ty * t:(ty + 1) * t, tx * t:(tx + 1) * t]
+            if tile.size == 0:
+                return None
+            data = encode_image(tile, "png")
+            with self._lock:
+                self._tiles[key] = data
+        return data
+
+
+class PyramidCache:
+    # Garde les pyramides des dernières images affichées, indexées par la clé de l'image
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._pyramids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            pyramid = self._pyramids.get(key)
+            if pyramid is not None:
+                self._pyramids.move_to_end(key)
+            return pyramid
+
+    # Récupère la pyramide de l'image `key`, en la construisant à partir de `img` si elle n'existe pas encore
+    def get_or_build(self, key, img):
+        pyramid = self.get(key)
+        if pyramid is None:
+            pyramid = TilePyramid(img)
+            with self._lock:
+                self._pyramids[key] = pyramid
+                while len(self._pyramids) > self.max_entries:
+                    self._pyramids.popitem(last=False)
+        return pyramid
+
+
+# Cache partagé par les applications du dossier
+pyramid_cache = PyramidCache()
+
+
+# Fonction pour ajouter au serveur Flask de Dash la route qui sert les tuiles
+# `load_image(image_key)` permet de reconstruire une pyramide évincée du cache (renvoie None si l'image est inconnue),
+# par exemple `shared_store.get` ; seules les images affichables (voir image_encoder.is_display_image) sont servies
+def register_tile_route(server, cache=pyramid_cache, prefix="/tiles", load_image=None):
+    def serve_tile(image_key, level, ty, tx):
+        pyramid = cache.get(image_key)
+        if pyramid is None and load_image is not None:
+            img = load_image(image_key)
+            if img is not None and is_display_image(img, "png"):
+                pyramid = cache.get_or_build(image_key, img)
+        if pyramid is None or level >= len(pyramid.levels):
+            abort(404)
+        data = pyramid.tile_png(level, ty, tx)
+        if data is None:
+            abort(404)
+        # La clé de l'image dépend de son contenu : une tuile ne change jamais et peut rester en cache
+        return Response(data, mimetype="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+    server.add_url_rule(prefix + "/<image_key>/<int:level>/<int:ty>/<int:tx>.png", "serve_tile", serve_tile)
+
+
+# Fonction pour construire les images de mise en page (layout.images) des tuiles visibles
+def tile_images(image_key, pyramid, x_range=None, y_range=None, prefix="/tiles"):
+    level = pyramid.level_for(x_range, y_range)
+    return [
+        dict(
+            source=f"{prefix}/{image_key}/{level}/{ty}/{tx}.png",
+            xref="x", yref="y",
+            x=x, y=y, sizex=sizex, sizey=sizey,
+            xanchor="left", yanchor="top",
+            sizing="stretch", layer="below",
+        )
+        for ty, tx, x, y, sizex, sizey in pyramid.tiles_in_view(level, x_range, y_range)
+    ]
+
+
+# Fonction pour créer une figure dont l'image est composée de tuiles, avec des axes en pixels pleine résolution
+def pyramid_figure(image_key, pyramid, prefix="/tiles"):
+    fig = go.Figure(
+        # Trace invisible aux coins de l'image pour que Plotly crée les axes
+        go.Scatter(x=[0, pyramid.width], y=[0, pyramid.height], mode="markers",
+                   marker_opacity=0, hoverinfo="skip", showlegend=False)
+    )
+    fig.update_layout(
+        images=tile_images(image_key, pyramid, prefix=prefix),
+        xaxis=dict(range=[0, pyramid.width], showgrid=False, zeroline=False, constrain="domain"),
+        yaxis=dict(range=[pyramid.height, 0], showgrid=False, zeroline=False, scaleanchor="x"),
+        uirevision=image_key,  # Garde le zoom quand seules les tuiles sont remplacées
+    )
+    return fig
@@ -1,18 +1,29 @@
-from dash import Dash, dcc, html, Input, Output, callback, no_update
+from dash import Dash, dcc, html, Input, Output, State, ALL, callback, ctx, no_update
 import plotly.express as px
 import numpy as np
 from skimage import data
 
-import base64, io
+import base64, hashlib, io, os, sys
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 
+# Registre d'images du dossier Dash_Image_Annotations : les images décodées sont écrites une seule fois sur disque
+# et ouvertes en mémoire mappée par tous les workers, qui retrouvent ainsi les téléversements des autres
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Dash_Image_Annotations"))
+from image_registry import registry
+
+# Pool de décodage : Pillow libère le GIL pendant le décodage, les fichiers téléversés sont donc décodés en parallèle
+decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+THUMBNAIL_SIZE = (160, 160)
+
 # external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = Dash(__name__) # , external_stylesheets=external_stylesheets
 
-# Chargement d'une image à partir du module scikit-image
-img_default = data.chelsea()
+# Chargement d'une image à partir du module scikit-image (partagée avec les autres applications par le registre)
+img_default = registry.get_or_create("skimage-chelsea", data.chelsea)
 
 # Création d'une figure Plotly Express à partir de l'image chargée
 fig = px.imshow(img_default)
@@ -29,6 +40,26 @@ config = {
     ]
 }
 
+# Fonction pour décoder un fichier téléversé et créer sa vignette (exécutée dans le pool de décodage)
+def decode_upload(contents, filename):
+    # Convertir les données de l'image en base64
+    decoded_img = base64.b64decode(contents.split(",")[1])
+    key = hashlib.blake2b(decoded_img, digest_size=16).hexdigest()
+    # Décoder les données base64 en tant qu'objet image uniquement si le fichier n'est pas déjà connu du registre
+    img_array = registry.get_or_create(key, lambda: np.array(Image.open(io.BytesIO(decoded_img))))
+    # Vignette sous-échantillonnée, encodée en JPEG pour la galerie
+    thumbnail = Image.fromarray(img_array).convert("RGB")
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=80)
+    return key, filename, "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+# Fonction pour créer la figure d'une image décodée
+def image_figure(img_array):
+    new_fig = px.imshow(img_array)
+    new_fig.update_layout(dragmode="drawrect")
+    return new_fig
+
 app.layout = html.Div([
     dcc.Upload(
         id='upload-image',
@@ -49,27 +80,50 @@ app.layout = html.Div([
         # Allow multiple files to be uploaded
         multiple=True
     ),
-    html.Div(id='output-image-upload'),
+    html.Div(id='output-image-upload', style={"display": "flex", "flexWrap": "wrap", "gap": "8px"}),  # Galerie des vignettes
     dcc.Graph(id='graph', figure=fig, config=config)  # Graphique interactif avec la figure et la configuration
 ])
 
+# Fonction callback pour décoder tous les fichiers téléversés en parallèle et afficher leur galerie
 @callback(
+    Output('output-image-upload', 'children'),
     Output('graph', 'figure'),
-    Input('upload-image', 'contents')
+    Input('upload-image', 'contents'),
+    State('upload-image', 'filename'),
+)
+def update_output(contents, filenames):
+    if contents is None:
+        return no_update, no_update
+    # Le temps total est celui du plus gros fichier, pas la somme de tous
+    results = list(decode_pool.map(decode_upload, contents, filenames))
+    # Un même fichier téléversé plusieurs fois n'a qu'une vignette (les id des vignettes doivent être uniques)
+    results = list({key: (key, filename, src) for key, filename, src in results}.values())
+    gallery = [
+        html.Img(
+            id={'type': 'thumbnail', 'index': key},
+            src=src,
+            title=filename,
+            style={"height": "80px", "cursor": "pointer", "border": "1px solid grey"},
+        )
+        for key, filename, src in results
+    ]
+    # La première image est ouverte en pleine résolution
+    first_img = registry.get(results[0][0])
+    return gallery, image_figure(first_img) if first_img is not None else no_update
+
+# Fonction callback pour ouvrir en pleine résolution l'image dont la vignette a été cliquée
+@callback(
+    Output('graph', 'figure', allow_duplicate=True),
+    Input({'type': 'thumbnail', 'index': ALL}, 'n_clicks'),
+    prevent_initial_call=True,
 )
-def update_output(contents):
-    if contents is not None:
-        # Convertir les données de l'image en base64
-        img_data = contents[0].split(",")[1]
-        # Décoder les données base64 en tant qu'objet image
-        decoded_img = base64.b64decode(img_data)
-        img_obj = Image.open(io.BytesIO(decoded_img))
-        # Créer une nouvelle figure Plotly Express avec l'objet image
-        new_fig = px.imshow(np.array(img_obj))
-        new_fig.update_layout(dragmode="drawrect")
-        return new_fig
-    else:
-        return no_update
+def open_image(n_clicks):
+    if not ctx.triggered or not ctx.triggered[0]['value']:
+        return no_update  # Vignettes tout juste ajoutées à la galerie, sans clic
+    img_array = registry.get(ctx.triggered_id['index'])
+    if img_array is None:
+        return no_update  # Image oubliée du registre : il faut la téléverser à nouveau
+    return image_figure(img_array)
 
 if __name__ == '__main__':
     app.run(debug=True)
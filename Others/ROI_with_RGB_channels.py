@@ -5,36 +5,44 @@ from dash import Dash, dcc, html, Input, Output, callback, no_update
 import numpy as np
 from skimage import data
 
-# Chargement d'une image à partir du module scikit-image
-img_default = data.chelsea()
+import os, sys
+
+# Registre d'images du dossier Dash_Image_Annotations : l'image est écrite une seule fois sur disque
+# et ouverte en mémoire mappée par tous les workers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Dash_Image_Annotations"))
+from image_registry import registry
+
+# Chargement d'une image à partir du module scikit-image (partagée avec les autres applications par le registre)
+img_default = registry.get_or_create("skimage-chelsea", data.chelsea)
 
 # Conversion de l'image en tableau NumPy
 img_array = np.array(img_default)
 
-# Séparer les canaux de couleur
-red_channel = img_array[:, :, 0]
-green_channel = img_array[:, :, 1]
-blue_channel = img_array[:, :, 2]
+# Comptage des 256 valeurs des trois canaux en un seul np.bincount : chaque canal est décalé de 256
+# (rouge 0-255, vert 256-511, bleu 512-767), seuls les comptes sont envoyés au navigateur
+offsets = np.arange(3) * 256
+counts = np.bincount((img_array[:, :, :3].astype(np.intp) + offsets).ravel(), minlength=3 * 256).reshape(3, 256)
+red_counts, green_counts, blue_counts = counts
 
 fig_hist = go.Figure()
-fig_hist.add_trace(go.Histogram(
-    x=red_channel.ravel(),
-    histnorm='',
+fig_hist.add_trace(go.Bar(
+    x=np.arange(256),
+    y=red_counts,
     name='Red', # name used in legend and hover labels
     marker_color='#FF0000', # Red color
     opacity=0.75
 ))
-fig_hist.add_trace(go.Histogram(
-    x=green_channel.ravel(),
-    histnorm='',
+fig_hist.add_trace(go.Bar(
+    x=np.arange(256),
+    y=green_counts,
     name='Green',
     marker_color='#00FF00', # Green color
     opacity=0.75
 ))
 
-fig_hist.add_trace(go.Histogram(
-    x=blue_channel.ravel(),
-    histnorm='',
+fig_hist.add_trace(go.Bar(
+    x=np.arange(256),
+    y=blue_counts,
     name='Blue',
     marker_color='#0000FF', # Blue color
     opacity=0.75
@@ -45,6 +53,8 @@ fig_hist.update_layout(
     title='Superposition de plusieurs fonctions sur un histogramme',
     xaxis_title='Valeurs 8bits des pixels',
     yaxis_title='Apparition dans le ROI',
+    barmode='overlay',  # Superposition des trois canaux
+    bargap=0,
 )
 
 # Initialisation de l'application Dash